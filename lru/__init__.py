@@ -1,6 +1,9 @@
 
 __version__ = '1.1'
-__all___ = ['LruCache', 'lazy_cache', 'lru_cache']
+__all___ = ['LruCache', 'lazy_cache', 'lru_cache', 'process_cache',
+             'batch_cache', 'stream_cache']
 
 from lru.cache import LruCache
-from lru.decorators import lazy_cache, lru_cache
+from lru.decorators import (
+  lazy_cache, lru_cache, process_cache, batch_cache, stream_cache
+)
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+
+"""The parts that need the async syntax of Python 3.5+,
+imported only by Pythons that have it.
+
+Copyright: (c) 2019 by Vasyl Paliy.
+License: MIT, see LICENSE for more details.
+"""
+
+from functools import wraps
+
+
+def scoped_coroutine(scope, function):
+  """Wraps a coroutine function, so that every call runs in scope()."""
+  @wraps(function)
+  async def _scoped_coroutine(*args, **kwargs):
+    with scope():
+      return await function(*args, **kwargs)
+  return _scoped_coroutine
@@ -0,0 +1,262 @@
+# -*- coding: future_fstrings -*-
+# -*- coding: utf-8 -*-
+
+"""Tools for sizing caches: an online miss ratio curve estimator,
+an access trace recorder, and an offline trace replay.
+
+  $ python -m lru.analysis trace.txt --sizes 100 1000 10000 --ttls 0 60
+
+Copyright: (c) 2019 by Vasyl Paliy.
+License: MIT, see LICENSE for more details.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+
+import argparse
+import heapq
+import io
+import threading
+
+from bisect import bisect_left
+from collections import namedtuple
+from lru.cache import LruCache
+from lru.compat import monotonic
+
+_READ, _WRITE = 'r', 'w'
+
+_HASH_BITS = 24
+_HASH_MASK = (1 << 64) - 1
+# a 64-bit multiplicative constant (golden ratio), which spreads
+# consecutive integers, whose hashes are the integers themselves
+_HASH_MULTIPLIER = 0x9E3779B97F4A7C15
+
+Access = namedtuple('Access', 'time op key')
+
+Result = namedtuple('Result', 'size ttl hits misses')
+
+
+def _spatial_hash(key):
+  """Maps a key to a uniformly distributed 24-bit number."""
+  return ((hash(key) * _HASH_MULTIPLIER) & _HASH_MASK) >> (64 - _HASH_BITS)
+
+
+class MissRatioCurve(object):
+  """Estimates the hit ratio that an LRU cache of any size would have
+  for the observed stream of lookups, using SHARDS spatial sampling.
+  Only keys whose hash falls below a threshold are tracked, so the memory
+  and the time spent is proportional to the sampling rate. Reuse distances
+  of the sampled keys are scaled up by 1 / rate.
+
+  At most max_keys keys are tracked (fixed-size SHARDS): when there are
+  more, the threshold is lowered to drop the keys with the highest hashes,
+  so the cost of a lookup does not grow with the key space.
+
+  >>> curve = MissRatioCurve(rate=0.01)
+  >>> cache = LruCache(maxsize=1000)
+  >>> cache.observe(curve)
+  >>> ...
+  >>> curve.hit_ratio(10000)
+  0.93
+
+  Attributes:
+    _threshold: keys with a spatial hash below this value are sampled.
+    _last: maps a sampled key to the logical time of its last access.
+    _times: sorted logical times of the last accesses, i.e. the LRU stack.
+    _keys: maps a spatial hash to the sampled keys that have it.
+    _hashes: a max-heap (of negated values) of the spatial hashes in _keys.
+    _histogram: maps a scaled reuse distance to the weight of its reuses.
+    _total: the weight of the sampled lookups.
+    _weight: the weight of a lookup sampled at the current rate. Lookups
+      sampled before the rate was lowered weigh less, instead of rescaling
+      the whole histogram every time.
+  """
+
+  def __init__(self, rate=0.01, max_keys=8192):
+    """
+    :param rate: the initial fraction of the keys to track.
+    :param max_keys: how many keys to track at most.
+    """
+    if not 0 < rate <= 1:
+      raise ValueError('rate should be in (0, 1]')
+    if max_keys <= 0:
+      raise ValueError('max_keys should not be less than or equal to 0')
+    self._threshold = int(rate * (1 << _HASH_BITS))
+    self._rate = self._threshold / (1 << _HASH_BITS)
+    self._max_keys = max_keys
+    self._lock = threading.Lock()
+    self._last = {}
+    self._times = []
+    self._keys = {}
+    self._hashes = []
+    self._clock = 0
+    self._histogram = {}
+    self._total = 0
+    self._weight = 1.0
+
+  def on_access(self, key, hit):
+    spatial = _spatial_hash(key)
+    if spatial >= self._threshold:
+      return
+    with self._lock:
+      # the threshold might have been lowered in the meantime
+      if spatial >= self._threshold:
+        return
+      self._clock += 1
+      previous = self._last.get(key)
+      if previous is not None:
+        times = self._times
+        index = bisect_left(times, previous)
+        # the number of distinct keys accessed since, including the key
+        distance = int((len(times) - index) / self._rate)
+        self._histogram[distance] = self._histogram.get(distance, 0) + self._weight
+        del times[index]
+      else:
+        keys = self._keys.get(spatial)
+        if keys is None:
+          keys = self._keys[spatial] = set()
+          heapq.heappush(self._hashes, -spatial)
+        keys.add(key)
+      self._times.append(self._clock)
+      self._last[key] = self._clock
+      self._total += self._weight
+      if len(self._last) > self._max_keys:
+        self._lower_threshold()
+
+  def _lower_threshold(self):
+    # stops sampling the keys with the highest hash, called with the lock held
+    spatial = -heapq.heappop(self._hashes)
+    times = self._times
+    for key in self._keys.pop(spatial):
+      del times[bisect_left(times, self._last.pop(key))]
+    if spatial:
+      self._weight *= self._threshold / spatial
+    self._threshold = spatial
+    self._rate = spatial / (1 << _HASH_BITS)
+
+  def on_add(self, key):
+    pass
+
+  def hit_ratio(self, size):
+    """Returns the estimated hit ratio of an LRU cache with maxsize=size."""
+    with self._lock:
+      if not self._total:
+        return 0.0
+      hits = sum(count for distance, count in self._histogram.items()
+                 if distance <= size)
+      return hits / self._total
+
+  def curve(self, sizes):
+    """Returns a list of (size, estimated hit ratio) pairs."""
+    return [(size, self.hit_ratio(size)) for size in sizes]
+
+
+class AccessTrace(object):
+  """Records the most recent accesses to a cache in a ring buffer.
+  Keys are recorded as their hashes, so the trace does not keep the
+  keys alive; the hashes are consistent within a single process only.
+
+  >>> trace = AccessTrace(capacity=1000000)
+  >>> cache.observe(trace)
+  >>> ...
+  >>> trace.save('trace.txt')
+
+  Attributes:
+    _buffer: a preallocated list of accesses.
+    _index: the total number of accesses that have been recorded.
+  """
+
+  def __init__(self, capacity=1 << 20):
+    if capacity <= 0:
+      raise ValueError('capacity should not be less than or equal to 0')
+    self._buffer = [None] * capacity
+    self._index = 0
+
+  def _record(self, op, key):
+    self._buffer[self._index % len(self._buffer)] = (monotonic(), op, hash(key))
+    self._index += 1
+
+  def on_access(self, key, hit):
+    self._record(_READ, key)
+
+  def on_add(self, key):
+    self._record(_WRITE, key)
+
+  def __len__(self):
+    return min(self._index, len(self._buffer))
+
+  def entries(self):
+    """Returns the recorded accesses from the oldest to the newest."""
+    index, buffer = self._index, self._buffer
+    if index <= len(buffer):
+      entries = buffer[:index]
+    else:
+      start = index % len(buffer)
+      entries = buffer[start:] + buffer[:start]
+    return [Access(*entry) for entry in entries]
+
+  def save(self, path):
+    """Writes the trace as lines of 'time op key'."""
+    with io.open(path, 'w', encoding='utf-8') as fp:
+      for time, op, key in self.entries():
+        fp.write(f'{time!r} {op} {key}\n')
+
+  @staticmethod
+  def load(path):
+    """Reads a trace written with `save`."""
+    with io.open(path, encoding='utf-8') as fp:
+      return [Access(float(time), op, int(key))
+              for time, op, key in (line.split() for line in fp if line.strip())]
+
+
+def replay(entries, sizes, ttls=(None,)):
+  """Runs a recorded trace against LruCache instances of different
+  sizes and expiration times. Lookups that miss load the key, as a
+  memoizing cache would. Expiration is simulated with the recorded
+  timestamps, so the replay does not depend on the wall clock.
+
+  :param entries: a list of Access tuples, e.g. from `AccessTrace.load`.
+  :param sizes: maxsize values to try.
+  :param ttls: expiration times in seconds to try, None means no expiration.
+  :return: a list of Result tuples.
+  """
+  results = []
+  for ttl in ttls:
+    for size in sizes:
+      cache, hits, misses = LruCache(maxsize=size, budget=False), 0, 0
+      for time, op, key in entries:
+        if op == _READ:
+          # the cached value is the time the key was loaded
+          loaded = cache.get(key)
+          if loaded is not None and ttl and time - loaded > ttl:
+            del cache[key]
+            loaded = None
+          if loaded is None:
+            misses += 1
+            cache.add(key, time)
+          else:
+            hits += 1
+        else:
+          cache.add(key, time)
+      results.append(Result(size, ttl, hits, misses))
+  return results
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(
+    prog='python -m lru.analysis',
+    description='Replays an access trace against caches of different sizes.')
+  parser.add_argument('trace', help='a trace written by AccessTrace.save()')
+  parser.add_argument('--sizes', type=int, nargs='+', required=True)
+  parser.add_argument('--ttls', type=float, nargs='+', default=[0],
+                      help='expiration times in seconds, 0 means no expiration')
+  args = parser.parse_args(argv)
+  entries = AccessTrace.load(args.trace)
+  print(f'{"size":>12} {"ttl":>10} {"hits":>12} {"misses":>12} {"hit ratio":>10}')
+  for size, ttl, hits, misses in replay(entries, args.sizes, args.ttls):
+    ratio = hits / (hits + misses) if hits + misses else 0.0
+    print(f'{size:>12} {ttl or "-":>10} {hits:>12} {misses:>12} {ratio:>10.4f}')
+
+
+if __name__ == '__main__':
+  main()
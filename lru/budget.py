@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+
+"""A process-wide budget shared by all LruCache instances.
+
+Copyright: (c) 2019 by Vasyl Paliy.
+License: MIT, see LICENSE for more details.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+
+import os
+import threading
+import weakref
+
+from lru import cache as _cache
+
+# the budget that is enforced right now, if any
+_budget = None
+
+
+def _allocate(limit, demands):
+  """Splits limit proportionally to the weights, never giving anybody
+  more than they ask for (water-filling). Whatever is not needed by
+  the capped ones is split among the rest.
+
+  :param demands: a list of (weight, cap) pairs.
+  :return: a list of allocations, at least 1 each.
+  """
+  allocations = [0] * len(demands)
+  active = list(range(len(demands)))
+  remaining = limit
+  while active:
+    total = sum(demands[index][0] for index in active)
+    capped = [index for index in active
+              if remaining * demands[index][0] / total >= demands[index][1]]
+    if not capped:
+      for index in active:
+        allocations[index] = int(remaining * demands[index][0] / total)
+      break
+    for index in capped:
+      allocations[index] = demands[index][1]
+      remaining -= demands[index][1]
+      active.remove(index)
+  return [max(allocation, 1) for allocation in allocations]
+
+
+class _Enforcer(threading.Thread):
+  daemon = True
+
+  def __init__(self, budget, interval, **kwargs):
+    self._budget_ref = weakref.ref(budget)
+    self._interval = interval
+    self.stopped = threading.Event()
+    super(_Enforcer, self).__init__(**kwargs)
+
+  def run(self):
+    while not self.stopped.wait(self._interval):
+      budget = self._budget_ref()
+      if budget is None:
+        break
+      budget.rebalance()
+      budget = None
+
+
+class MemoryBudget(object):
+  """Limits the total number of items kept by all LruCache instances
+  in the process. Caches are found through a registry of weak references,
+  so nothing has to be registered explicitly. Caches created with
+  budget=False, such as the ones used internally by other caches,
+  are left alone.
+
+  When the caches ask for more than the limit, each cache gets a share
+  proportional to the number of hits it has had since the last rebalance,
+  i.e. caches that are rarely hit shrink the most. A cache never grows
+  beyond the maxsize it has been created with. Shrinking is done with
+  `LruCache.resize` in bounded batches.
+
+  >>> budget = MemoryBudget(limit=100000)
+  >>> budget.rebalance() # or budget.start(interval=1) to do it periodically
+
+  Attributes:
+    _hits: maps a cache id to its number of hits at the last rebalance.
+  """
+
+  def __init__(self, limit):
+    if limit <= 0:
+      raise ValueError('limit should not be less than or equal to 0')
+    self.limit = limit
+    self._lock = threading.Lock()
+    self._hits = {}
+    self._enforcer = None
+
+  def rebalance(self):
+    """Recomputes the size of every cache and resizes them accordingly."""
+    with self._lock:
+      caches = _cache._budgeted_caches()
+      if not caches:
+        return
+      hits, demands = {}, []
+      for cache in caches:
+        hits[id(cache)] = cache._hits
+        recent = max(cache._hits - self._hits.get(id(cache), 0), 0)
+        # every cache gets some weight, so that idle caches aren't emptied
+        demands.append((recent + 1, cache._capacity))
+      self._hits = hits
+      for cache, size in zip(caches, _allocate(self.limit, demands)):
+        if size != cache._maxsize:
+          cache._resize(size)
+
+  def start(self, interval=1.0):
+    """Rebalances in a daemon thread every interval seconds."""
+    if self._enforcer is None:
+      self._enforcer = _Enforcer(self, interval)
+      self._enforcer.start()
+
+  def stop(self):
+    if self._enforcer is not None:
+      self._enforcer.stopped.set()
+      self._enforcer = None
+
+
+def set_memory_budget(limit, interval=1.0):
+  """Enforces a process-wide limit on the number of cached items,
+  rebalancing every interval seconds. Passing None removes the limit
+  and lets every cache grow back to its maxsize.
+  """
+  global _budget
+  if _budget is not None:
+    _budget.stop()
+    _budget = None
+  if limit is None:
+    for cache in _cache._budgeted_caches():
+      cache._maxsize = cache._capacity
+    return None
+  _budget = MemoryBudget(limit)
+  _budget.rebalance()
+  _budget.start(interval)
+  return _budget
+
+
+def _after_fork_in_child():
+  # the enforcer thread does not exist in the child process
+  budget = _budget
+  if budget is not None and budget._enforcer is not None:
+    interval = budget._enforcer._interval
+    budget._enforcer = None
+    budget.start(interval)
+
+
+if hasattr(os, 'register_at_fork'):
+  os.register_at_fork(after_in_child=_after_fork_in_child)
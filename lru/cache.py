@@ -10,12 +10,18 @@ License: MIT, see LICENSE for more details.
 from __future__ import absolute_import
 from __future__ import with_statement
 
+import itertools
+import os
 import threading
 import time
 import weakref
 
+from contextlib import contextmanager
+from collections import namedtuple
 from functools import total_ordering, wraps
-from lru.compat import queue, MutableMapping, monotonic
+from lru.clock import default_clock
+from lru.compat import queue, MutableMapping
+from lru.sketch import HotKeys
 
 # internal objects
 
@@ -23,6 +29,15 @@ _sentinel = object()
 
 _DEFAULT_CACHE_SIZE = 128
 
+# how many items `resize` evicts while holding the lock
+_RESIZE_BATCH_SIZE = 1000
+
+CacheInfo = namedtuple('CacheInfo', 'hits misses maxsize currsize')
+
+# keyword arguments consumed by the constructor, everything
+# else is treated as an initial key-value pair
+_OPTIONS = ('maxsize', 'concurrent', 'expires', 'hot_keys', 'clock', 'budget')
+
 
 def lock(method):
   """A decorator that prevents a potential race condition scenario.
@@ -70,15 +85,6 @@ class _ExpNode(_Node):
     super(_ExpNode, self).__init__(*args, **kwargs)
     self.expires = expires
 
-  @property
-  def remaining(self):
-    """Returns how much time the record has before being deleted."""
-    return self.expires - monotonic()
-
-  @property
-  def is_expired(self):
-    return monotonic() > self.expires
-
   def __eq__(self, other):
     if not isinstance(other, _ExpNode):
       raise TypeError(f'Expected _ExpNode, got {type(other)}')
@@ -91,7 +97,8 @@ class _ExpNode(_Node):
 
   def __repr__(self):
     classname = self.__class__.__name__
-    return f'{classname} {self.key}:({self.remaining})'
+    # the expiration time is on the scale of the cache clock
+    return f'{classname} {self.key}:(expires at {self.expires})'
 
 
 def _create_node(key=None, value=None, next=None, prev=None, expires=None):
@@ -103,7 +110,7 @@ def _create_node(key=None, value=None, next=None, prev=None, expires=None):
 
 class _CacheCleaner(threading.Thread):
   """A daemon thread that is responsible for cleaning up stale items.
-  It receives proxied items from a shared queue, picks up the one with
+  It receives weakly referenced items from a shared queue, picks up the one with
   the shortest life span, and uses a condition variable to wait until the
   item expires. If the item is deleted before it has expired, _CacheCleaner
   is notified and ready to pull out the next item from the queue. If a new item
@@ -111,23 +118,32 @@ class _CacheCleaner(threading.Thread):
   waiting to become stale), we _CacheCleaner will replace the current item with the new one.
 
   Attributes:
-    _queue: a priority queue through which new items are being pushed through.
+    _queue: a priority queue of (expires, sequence number, weak reference) entries.
+      An entry holding the _sentinel instead of a reference stops the thread.
     _condition: a condition variable that serves as the waiting mechanism.
       The condition variable is notified ("awoken" from sleep) when an event such
       as adding or deleting an item occurs.
     _cache_ref: a weak reference to the cache object for which this daemon thread is serving.
       It is used for two things: delete a stale item from the cache, and stop the daemon thread
       when the last reference to the cache instance has been garbage collected.
+    _clock: the clock of the cache, which tells the time and does the waiting.
   """
 
   daemon = True
 
-  def __init__(self, queue, cache, condition, **kwargs):
+  def __init__(self, queue, cache, condition, on_collected=None,
+               clock=default_clock, **kwargs):
     self._queue = queue
-    self._cache_ref = weakref.ref(cache)
+    self._cache_ref = weakref.ref(cache, on_collected)
     self._condition = condition
+    self._clock = clock
     super(_CacheCleaner, self).__init__(**kwargs)
 
+  def _next(self):
+    entry = self._queue.get_nowait()
+    self._queue.task_done()
+    return entry
+
   def run(self):
     """Contains a loop that continually cleans up stale items
     from the cache. It does not waste CPU resources by waiting
@@ -136,46 +152,56 @@ class _CacheCleaner(threading.Thread):
     """
     node_queue = self._queue
     condition = self._condition
+    clock = self._clock
+    clock.register(condition)
     while True:
-      cache = self._cache_ref()
-      # checking if the cache instance
-      # hasn't been garbage collected
-      if cache is None:
-        break
-      # non-blocking wait for a new item
-      node = node_queue.get()
+      # blocking wait for a new item
+      entry = node_queue.get()
+      node_queue.task_done()
+      with condition:
+        while entry[-1] is not _sentinel:
+          expires, _, ref = entry
+          # the item has been deleted or replaced in the meantime
+          if ref() is None:
+            break
+          remaining = expires - clock.now()
+          if remaining <= 0:
+            break
+          clock.wait(condition, remaining)
+          try:
+            fast = self._next()
+          except queue.Empty:
+            continue
+          if fast < entry:
+            fast, entry = entry, fast
+          node_queue.put(fast)
       # if the clean up process has been manually stopped
       # kill the thread
-      if node is _sentinel:
+      if entry[-1] is _sentinel:
         break
-      with condition:
-        while node and (not node.is_expired):
-          condition.wait(node.remaining)
-          try:
-            fast = node_queue.get_nowait()
-            if (fast and node) and (fast < node):
-              node_queue.put(node)
-              node = fast
-            elif fast is not None:
-              node_queue.put(fast)
-          except (queue.Empty, ReferenceError) as error:
-            if isinstance(error, ReferenceError):
-              node = fast
-        node_queue.task_done()
-        if cache and node:
-          del cache[node.key]
-        cache = None
+      node = entry[-1]()
+      if node is not None:
+        cache = self._cache_ref()
+        # checking if the cache instance
+        # hasn't been garbage collected
+        if cache is None:
+          break
+        # the cache lock is taken outside of the condition,
+        # otherwise we might deadlock with __delitem__
+        cache._expire(node)
+        cache = node = None
 
 
 class _CleanManager(object):
   """The middleman between _CacheCleaner and LruCache.
   Responsible for starting the daemon cleaner, passing down
-  proxied nodes to it through the shared queue, and notifying the
+  weakly referenced nodes to it through the shared queue, and notifying the
   cleaner object about different events via condition variable.
 
   Attributes:
     _queue: priority queue used for communication with the cleaner.
     _condition: condition variable for notifying the cleaner about events.
+    _counter: breaks ties between items that expire at the same time.
     _cache_cleaner: a daemon thread, _CacheCleaner, for cleaning up cached items.
     _initialized: a boolean variable indicating whether the cleaner has been started.
   """
@@ -183,13 +209,16 @@ class _CleanManager(object):
   def __init__(self, cache):
     self._queue = queue.PriorityQueue()
     self._condition = threading.Condition()
+    self._counter = itertools.count()
     self._cache_cleaner = _CacheCleaner(
-      self._queue, cache, self._condition
+      self._queue, cache, self._condition,
+      on_collected=lambda ref, stop=self.stop: stop(),
+      clock=cache._clock
     )
     self._initialized = False
 
   def add(self, node):
-    """Creates a proxy of the node and puts this in the queue.
+    """Puts a weak reference to the node in the queue.
     As well as wakes up (if needed) the cleaner to consider
     waiting for the new item, potentially with a shorter life span.
 
@@ -199,8 +228,8 @@ class _CleanManager(object):
       if not self._initialized:
         self._initialized = True
         self._cache_cleaner.start()
-      node = weakref.proxy(node)
-      self._queue.put(node)
+      ref = weakref.ref(node)
+      self._queue.put((node.expires, next(self._counter), ref))
       self._notify()
 
   def _notify(self):
@@ -219,6 +248,81 @@ class _CleanManager(object):
     """
     self._notify()
 
+  def stop(self):
+    """Makes the cleaner exit as soon as it wakes up.
+    The _sentinel is queued ahead of every item.
+    """
+    if self._initialized:
+      self._queue.put((float('-inf'), next(self._counter), _sentinel))
+      self._notify()
+
+
+# every live cache, so that we can repair them in a forked child.
+# caches are unhashable, that's why they are indexed by their id
+_caches = weakref.WeakValueDictionary()
+
+# the caches that share the memory budget, see `lru.budget`
+_budgeted = weakref.WeakValueDictionary()
+
+# guards adding to the registries, so that they can be listed
+# while caches are being created in other threads
+_registry_lock = threading.Lock()
+
+
+def _register(cache, budget):
+  with _registry_lock:
+    _caches[id(cache)] = cache
+    if budget:
+      _budgeted[id(cache)] = cache
+
+
+def _budgeted_caches():
+  with _registry_lock:
+    return list(_budgeted.values())
+
+
+def _after_fork_in_child():
+  global _registry_lock
+  # another thread of the parent might have held it
+  _registry_lock = threading.Lock()
+  for cache in list(_caches.values()):
+    cache._after_fork()
+
+
+if hasattr(os, 'register_at_fork'):
+  os.register_at_fork(after_in_child=_after_fork_in_child)
+
+
+class _KeyLocks(object):
+  """Hands out a reentrant lock per key, so that loading one key
+  does not block threads that are working with other keys.
+  A lock lives only as long as somebody is holding or waiting for it.
+
+  Attributes:
+    _mutex: guards the table of locks.
+    _locks: maps a key to a pair of [lock, number of holders and waiters].
+  """
+
+  def __init__(self):
+    self._mutex = threading.Lock()
+    self._locks = {}
+
+  @contextmanager
+  def __call__(self, key):
+    with self._mutex:
+      entry = self._locks.get(key)
+      if entry is None:
+        entry = self._locks[key] = [threading.RLock(), 0]
+      entry[1] += 1
+    try:
+      with entry[0]:
+        yield
+    finally:
+      with self._mutex:
+        entry[1] -= 1
+        if not entry[1]:
+          del self._locks[key]
+
 
 class LruCache(MutableMapping):
   """A dictionary-like data structure, supporting LRU caching semantics.
@@ -254,6 +358,12 @@ class LruCache(MutableMapping):
     :param concurrent: a boolean value that indicates whether or not
       the cache will be used in multi-thread environment.
     :param expires: for how long should we retain added items.
+    :param hot_keys: how many of the most accessed and the most missed
+      keys to track, see `hot_keys()` and `missed_keys()`.
+    :param clock: the time source for expiration, see `lru.clock`.
+    :param budget: whether the cache shares the memory budget of the
+      process, see `lru.budget`. Caches used internally by other caches
+      opt out, they are sized by their owners.
     """
     if not args:
       raise ValueError('__init__() needs an argument')
@@ -264,17 +374,31 @@ class LruCache(MutableMapping):
     try:
       self._maxsize
     except AttributeError:
-      self._maxsize = kwargs['maxsize']
+      # the size requested by the user, and the size we have right now,
+      # which might be smaller because of the memory budget
+      self._capacity = self._maxsize = kwargs['maxsize']
+      self._hits = self._misses = 0
       self._hardroot = _Node()
       root = self._root = weakref.proxy(self._hardroot)
       root.next = root.prev = root
       self._mapping = {}
+      # tag -> keys, and key -> tags
+      self._tags, self._key_tags = {}, {}
+      self._key_locks = _KeyLocks()
+      # set while `get_or_set` adds the value it has loaded
+      self._loading = threading.local()
       self._expires = expires = kwargs.get('expires')
+      self._clock = kwargs.get('clock') or default_clock
       if kwargs.get('concurrent', False):
         self._lock = threading.RLock()
       if expires:
         self._init_cleaner_manager()
-    del kwargs['maxsize']
+      if kwargs.get('hot_keys'):
+        self._hot_keys = HotKeys(kwargs['hot_keys'])
+        self.observe(self._hot_keys)
+      _register(self, kwargs.get('budget', True))
+    for option in _OPTIONS:
+      kwargs.pop(option, None)
     self.update(*args, **kwargs)
 
   def _init_cleaner_manager(self):
@@ -282,6 +406,62 @@ class LruCache(MutableMapping):
     if not hasattr(self,'_lock'):
       self._lock = threading.RLock()
 
+  def _after_fork(self):
+    # the parent's locks may have been held by other threads at the time of
+    # the fork, and the cleaner thread does not exist in the child process
+    if hasattr(self, '_lock'):
+      self._lock = threading.RLock()
+    self._key_locks = _KeyLocks()
+    if hasattr(self, '_cleaner_manager'):
+      self._init_cleaner_manager()
+      for node in self._iterator():
+        self._cleaner_manager.add(node)
+
+  @lock
+  def close(self):
+    """Stops the cache cleaner. Items that are already cached are kept,
+    but they will not be removed when they expire. Adding a new expiring
+    item starts a fresh cleaner.
+    """
+    if hasattr(self, '_cleaner_manager'):
+      self._cleaner_manager.stop()
+      del self._cleaner_manager
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc_info):
+    self.close()
+
+  @lock
+  def __getstate__(self):
+    # monotonic time is meaningless in another process,
+    # so we ship how much time every item has left instead
+    now = self._clock.now()
+    items = [(node.key, node.value, getattr(node, 'expires', None),
+              self._key_tags.get(node.key)) for node in self._iterator()]
+    items = [(key, value, expires if expires is None else expires - now, tags)
+             for key, value, expires, tags in items]
+    return {
+      'maxsize': self._capacity,
+      'expires': self._expires,
+      'concurrent': hasattr(self, '_lock'),
+      'hot_keys': self._hot_keys.accessed._capacity
+        if hasattr(self, '_hot_keys') else None,
+      'budget': _budgeted.get(id(self)) is self,
+      'items': items
+    }
+
+  def __setstate__(self, state):
+    # everything but the items are the options of the constructor,
+    # so subclasses only have to add theirs to the state
+    options = dict(state)
+    items = options.pop('items')
+    self.__init__(**options)
+    for key, value, remaining, tags in reversed(items):
+      if remaining is None or remaining > 0:
+        self.add(key, value, expires=remaining, tags=tags)
+
   def _bump_up(self, node):
     root = self._root
     if root.next is not node:
@@ -296,23 +476,129 @@ class LruCache(MutableMapping):
     root.next.prev = node
     root.next = node
 
-  @lock
   def __getitem__(self, key):
-    node = self._mapping[key]
-    self._bump_up(node)
-    return node.value
+    value = self.get(key, _sentinel)
+    if value is _sentinel:
+      raise KeyError(key)
+    return value
 
   def __setitem__(self, key, value):
     self.add(key, value)
 
   @lock
-  def add(self, key, value, expires=None):
+  def get(self, key, default=None):
+    """Returns the value for key if the key is in the cache, else default.
+    Unlike `__getitem__`, a miss costs a single lookup and no exception.
+    """
+    node = self._lookup(key)
+    if hasattr(self, '_observers'):
+      self._notify_access(key, node is not None)
+    if node is None:
+      self._misses += 1
+      return default
+    self._hits += 1
+    self._bump_up(node)
+    return node.value
+
+  @lock
+  def get_many(self, keys, default=None):
+    """Looks up several keys at once, acquiring the lock only once.
+    Returns a list of values in the order of the keys, with default
+    in place of every missing key.
+    """
+    values, hits = [], 0
+    observed = hasattr(self, '_observers')
+    for key in keys:
+      node = self._lookup(key)
+      if observed:
+        self._notify_access(key, node is not None)
+      if node is None:
+        values.append(default)
+      else:
+        hits += 1
+        self._bump_up(node)
+        values.append(node.value)
+    self._hits += hits
+    self._misses += len(values) - hits
+    return values
+
+  @lock
+  def _peek(self, key, default=None):
+    # `get` that is neither counted nor observed
+    node = self._lookup(key)
+    if node is None:
+      return default
+    self._bump_up(node)
+    return node.value
+
+  def _lookup(self, key):
+    # the cleaner might not have removed an expired item yet
+    node = self._mapping.get(key)
+    if type(node) is _ExpNode and node.expires <= self._clock.now():
+      del self[key]
+      return None
+    return node
+
+  def get_or_set(self, key, loader, expires=None, tags=None):
+    """Returns the value for key, calling loader() to produce and cache
+    the value if the key is missing. Concurrent calls for the same key
+    run the loader only once; calls for other keys are not blocked.
+
+    :param key: an arbitrary key that is hashable
+    :param loader: a callable without arguments that produces the value
+    :param expires: indicates in how many seconds
+      should the new item expire.
+    :param tags: tags of the new item, see `add`.
+    """
+    value = self.get(key, _sentinel)
+    if value is not _sentinel:
+      return value
+    with self._key_locks(key):
+      # another thread might have loaded the key while we were waiting,
+      # that's still the lookup we have reported, so it's not counted again
+      value = self._peek(key, _sentinel)
+      if value is _sentinel:
+        value = loader()
+        self._loading.active = True
+        try:
+          self.add(key, value, expires=expires, tags=tags)
+        finally:
+          self._loading.active = False
+      return value
+
+  def compute(self, key, function, expires=None, tags=None):
+    """Atomically replaces the value for key with function(key, value),
+    where value is the current value or None if the key is missing.
+    If the function returns None, the key is removed from the cache.
+    Atomicity is guaranteed with respect to other `get_or_set` and
+    `compute` calls for the same key.
+
+    :param key: an arbitrary key that is hashable
+    :param function: a callable that takes the key and its current value
+    :param expires: indicates in how many seconds
+      should the new item expire.
+    :param tags: tags of the new item, see `add`.
+    :return: the new value or None
+    """
+    with self._key_locks(key):
+      value = function(key, self.get(key))
+      if value is None:
+        self.pop(key, None)
+      else:
+        self.add(key, value, expires=expires, tags=tags)
+      return value
+
+  @lock
+  def add(self, key, value, expires=None, tags=None):
     """Adds a key-value pair to the cache.
     :param key: an arbitrary key that is hashable
     :param value: an arbitrary value
     :param expires: indicates in how many seconds
       should the new item expire. If none provided,
       the default duration (if exists) will be used.
+    :param tags: an iterable of hashable tags, which allow
+      to remove related items at once with `invalidate_tag`.
+      Tags belong to the item, adding the key again replaces them.
     """
     if any([key is None, value is None]):
       raise ValueError('Key and value must not be None')
@@ -321,26 +607,156 @@ class LruCache(MutableMapping):
     if key in self._mapping:
       node = self._mapping[key]
       del self[node.key]
-    if len(self._mapping) > self._maxsize:
-      del self[self._root.prev.key]
+    if len(self._mapping) >= self._maxsize:
+      self._evict(self._next_victim())
     node = _create_node(key, value, expires=expires)
     self._mapping[key] = node
     self._connect_with_root(node)
+    if tags:
+      self._tag(key, tags)
+    # the add of a loaded value is a part of the lookup that missed
+    if (hasattr(self, '_observers') and
+        not getattr(self._loading, 'active', False)):
+      for observer in self._observers:
+        observer.on_add(key)
     if expires and not hasattr(self, '_cleaner_manager'):
       self._init_cleaner_manager()
     if hasattr(self, '_cleaner_manager'):
       self._cleaner_manager.add(node)
 
+  def _tag(self, key, tags):
+    tags = self._key_tags[key] = frozenset(tags)
+    for tag in tags:
+      self._tags.setdefault(tag, set()).add(key)
+
+  def _untag(self, key):
+    for tag in self._key_tags.pop(key):
+      keys = self._tags[tag]
+      keys.discard(key)
+      if not keys:
+        del self._tags[tag]
+
+  @lock
+  def invalidate_tag(self, tag):
+    """Removes every item tagged with tag. The cost is proportional
+    to the number of those items, not to the size of the cache.
+
+    :return: the number of removed items.
+    """
+    keys = list(self._tags.get(tag, ()))
+    for key in keys:
+      del self[key]
+    return len(keys)
+
+  @lock
+  def tagged(self, tag):
+    """Returns the keys of the items tagged with tag."""
+    return list(self._tags.get(tag, ()))
+
+  @lock
+  def observe(self, observer):
+    """Registers an observer of the access stream, e.g. a miss ratio
+    curve estimator or a trace recorder from `lru.analysis`.
+    `observer.on_access(key, hit)` is called on every lookup, and
+    `observer.on_add(key)` is called whenever a key is added, except for
+    the values loaded by `get_or_set`, whose lookup has already been
+    reported. Both are called while holding the cache lock, so they
+    must be cheap.
+    """
+    self._observers = getattr(self, '_observers', ()) + (observer,)
+
+  @lock
+  def unobserve(self, observer):
+    """Unregisters an observer added with `observe`."""
+    observers = tuple(item for item in getattr(self, '_observers', ())
+                      if item is not observer)
+    if observers:
+      self._observers = observers
+    elif hasattr(self, '_observers'):
+      del self._observers
+
+  def _get_hot_keys(self):
+    try:
+      return self._hot_keys
+    except AttributeError:
+      raise ValueError('Hot keys are not tracked, pass hot_keys to the constructor')
+
+  @lock
+  def hot_keys(self, n=None):
+    """Returns the approximate top n most accessed (read or added) keys
+    as (key, count, error) tuples, where the true number of accesses
+    is between count - error and count.
+    """
+    return self._get_hot_keys().accessed.top(n)
+
+  @lock
+  def missed_keys(self, n=None):
+    """Returns the approximate top n keys that miss most often
+    as (key, count, error) tuples.
+    """
+    return self._get_hot_keys().missed.top(n)
+
+  def _notify_access(self, key, hit):
+    for observer in self._observers:
+      observer.on_access(key, hit)
+
   def _get_expiration_time(self, expires):
     if expires is not None:
-      expires = monotonic() + expires
+      expires = self._clock.now() + expires
     elif self._expires is not None:
-      expires = monotonic() + self._expires
+      expires = self._clock.now() + self._expires
     return expires
 
+  def _next_victim(self):
+    # the node to evict when the cache is full, called with the lock held
+    return self._root.prev
+
+  def _evict(self, node):
+    # makes room for a new item, called with the lock held
+    del self[node.key]
+
+  def resize(self, maxsize, batch_size=_RESIZE_BATCH_SIZE):
+    """Changes the number of items the cache can keep. When shrinking,
+    the least recently used items are evicted in batches of batch_size,
+    and the lock is released between batches, so that other threads
+    are not blocked for the whole time.
+    """
+    if maxsize <= 0:
+      raise ValueError('maxsize should not be less than or equal to 0')
+    self._capacity = maxsize
+    self._resize(maxsize, batch_size)
+
+  def _resize(self, maxsize, batch_size=_RESIZE_BATCH_SIZE):
+    # unlike `resize`, keeps the capacity requested by the user
+    self._maxsize = maxsize
+    while self._shrink(batch_size):
+      pass
+
+  @lock
+  def _shrink(self, batch_size):
+    # evicts up to batch_size items, returns whether there is more to evict
+    mapping = self._mapping
+    while batch_size and len(mapping) > self._maxsize:
+      self._evict(self._next_victim())
+      batch_size -= 1
+    return len(mapping) > self._maxsize
+
+  @lock
+  def info(self):
+    """Returns the statistics of the cache as a CacheInfo tuple."""
+    return CacheInfo(self._hits, self._misses, self._maxsize, len(self._mapping))
+
+  @lock
+  def _expire(self, node):
+    # the key might have been re-added with a new node
+    if self._mapping.get(node.key) is node:
+      del self[node.key]
+
   @lock
   def __delitem__(self, key):
     node = self._mapping.pop(key)
+    if key in self._key_tags:
+      self._untag(key)
     next, prev = node.next, node.prev
     next.prev = prev
     prev.next = next
@@ -353,7 +769,7 @@ class LruCache(MutableMapping):
 
   @lock
   def __contains__(self, key):
-    return key in self._mapping
+    return self._lookup(key) is not None
 
   @lock
   def __len__(self):
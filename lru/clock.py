@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+
+"""Time sources for expiration.
+
+Copyright: (c) 2019 by Vasyl Paliy.
+License: MIT, see LICENSE for more details.
+"""
+
+from __future__ import absolute_import
+
+import os
+import threading
+import time
+import weakref
+
+from lru.compat import monotonic
+
+
+class Clock(object):
+  """The time source of a cache. `now` returns seconds on a monotonic
+  scale, and `wait` blocks on a condition variable until it is notified
+  or until timeout seconds have passed according to this clock.
+  """
+
+  def now(self):
+    raise NotImplementedError
+
+  def register(self, condition):
+    """Called by a thread that is going to `wait` on condition,
+    before it reads the time to compute the timeout.
+    """
+
+  def wait(self, condition, timeout):
+    """Called with the condition acquired, like `Condition.wait`."""
+    condition.wait(timeout)
+
+
+class MonotonicClock(Clock):
+  """Reads `time.monotonic` every time, the default."""
+
+  def now(self):
+    return monotonic()
+
+
+class _Ticker(threading.Thread):
+  daemon = True
+
+  def __init__(self, clock, resolution, **kwargs):
+    self._clock_ref = weakref.ref(clock)
+    self._resolution = resolution
+    super(_Ticker, self).__init__(**kwargs)
+
+  def run(self):
+    while True:
+      time.sleep(self._resolution)
+      clock = self._clock_ref()
+      if clock is None:
+        break
+      clock._now = monotonic()
+      clock = None
+
+
+class CoarseClock(Clock):
+  """A clock that is updated by a background thread every resolution
+  seconds, so reading it is an attribute access instead of a system call.
+  Items may expire up to resolution seconds late.
+
+  >>> cache = LruCache(maxsize=10000, expires=60, clock=CoarseClock(0.005))
+  """
+
+  def __init__(self, resolution=0.005):
+    """
+    :param resolution: how often, in seconds, the time is updated.
+    """
+    if resolution <= 0:
+      raise ValueError('resolution should not be less than or equal to 0')
+    self._resolution = resolution
+    self._now = monotonic()
+    self._start_ticker()
+    _coarse_clocks[id(self)] = self
+
+  def _start_ticker(self):
+    self._ticker = _Ticker(self, self._resolution)
+    self._ticker.start()
+
+  def now(self):
+    return self._now
+
+
+class VirtualClock(Clock):
+  """A clock that only moves when `advance` is called, intended for tests.
+  Threads waiting on it (e.g. the cache cleaner) are woken up whenever
+  the time moves, so expiration does not depend on the wall clock.
+
+  >>> clock = VirtualClock()
+  >>> cache = LruCache(expires=60, clock=clock)
+  >>> cache['foo'] = 'bar'
+  >>> clock.advance(61)
+  >>> 'foo' in cache
+  False
+
+  Attributes:
+    _waiting: the conditions that threads are waiting, or about to wait, on.
+  """
+
+  def __init__(self, start=0.0):
+    self._now = start
+    self._mutex = threading.Lock()
+    self._waiting = weakref.WeakSet()
+
+  def now(self):
+    return self._now
+
+  def advance(self, seconds):
+    """Moves the time forward and wakes up the waiting threads."""
+    if seconds < 0:
+      raise ValueError('a monotonic clock cannot go backwards')
+    with self._mutex:
+      self._now += seconds
+      waiting = list(self._waiting)
+    for condition in waiting:
+      with condition:
+        condition.notify_all()
+
+  def register(self, condition):
+    # registering only in `wait` would be too late: `advance` could
+    # run after the waiter has read the time, and not notify it
+    with self._mutex:
+      self._waiting.add(condition)
+
+  def wait(self, condition, timeout):
+    self.register(condition)
+    # whatever the timeout is, only `advance` can make it pass
+    condition.wait()
+
+
+default_clock = MonotonicClock()
+
+# coarse clocks lose their ticker in a forked child
+_coarse_clocks = weakref.WeakValueDictionary()
+
+
+def _after_fork_in_child():
+  for clock in list(_coarse_clocks.values()):
+    clock._start_ticker()
+
+
+if hasattr(os, 'register_at_fork'):
+  os.register_at_fork(after_in_child=_after_fork_in_child)
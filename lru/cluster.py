@@ -0,0 +1,437 @@
+# -*- coding: utf-8 -*-
+
+"""A cache partitioned between peer processes, in the spirit of groupcache.
+
+Copyright: (c) 2019 by Vasyl Paliy.
+License: MIT, see LICENSE for more details.
+"""
+
+from __future__ import absolute_import
+
+import bisect
+import hashlib
+import itertools
+import os
+import pickle
+import socket
+import struct
+import threading
+
+from lru.cache import LruCache
+from lru.compat import basestring, bytes, futures, str
+
+# every frame starts with the length of its pickled payload
+_HEADER = struct.Struct('!I')
+
+_PROTOCOL = 2
+
+
+class _PeerUnavailable(Exception):
+  """The owner of a key could not be reached in time."""
+
+
+def _key_bytes(key):
+  # hash() is randomized per process, the ring needs a stable one
+  if isinstance(key, bytes):
+    return key
+  if isinstance(key, str):
+    return key.encode('utf-8')
+  return pickle.dumps(key, protocol=_PROTOCOL)
+
+
+def _hash(data):
+  return int(hashlib.md5(data).hexdigest()[:16], 16)
+
+
+def _peer_name(address):
+  if isinstance(address, basestring):
+    return address
+  return '{}:{}'.format(*address)
+
+
+def _family(address):
+  return socket.AF_UNIX if isinstance(address, basestring) else socket.AF_INET
+
+
+def _send(sock, payload):
+  data = pickle.dumps(payload, protocol=_PROTOCOL)
+  sock.sendall(_HEADER.pack(len(data)) + data)
+
+
+def _recv_exactly(sock, size):
+  chunks = []
+  while size:
+    chunk = sock.recv(min(size, 1 << 16))
+    if not chunk:
+      raise EOFError('the peer has closed the connection')
+    chunks.append(chunk)
+    size -= len(chunk)
+  return b''.join(chunks)
+
+
+def _recv(sock):
+  size, = _HEADER.unpack(_recv_exactly(sock, _HEADER.size))
+  return pickle.loads(_recv_exactly(sock, size))
+
+
+class HashRing(object):
+  """Maps keys to peers with consistent hashing, so that adding
+  or removing a peer moves only the keys of that peer. Every peer
+  is placed on the ring replicas times to even out the load.
+
+  >>> ring = HashRing(['/tmp/a.sock', '/tmp/b.sock'])
+  >>> ring.owner('foo') # the same peer in every process
+  '/tmp/b.sock'
+  """
+
+  def __init__(self, peers, replicas=64):
+    if not peers:
+      raise ValueError('a ring needs at least one peer')
+    points = sorted(
+      (_hash('{}#{}'.format(peer, index).encode('utf-8')), peer)
+      for peer in peers for index in range(replicas))
+    self._hashes = [point for point, _ in points]
+    self._peers = [peer for _, peer in points]
+
+  def owner(self, key):
+    index = bisect.bisect(self._hashes, _hash(_key_bytes(key)))
+    return self._peers[index % len(self._peers)]
+
+
+class _Reply(object):
+  def __init__(self):
+    self._event = threading.Event()
+    self._ok = self._value = None
+
+  def set(self, ok, value):
+    self._ok, self._value = ok, value
+    self._event.set()
+
+  def wait(self, timeout):
+    if not self._event.wait(timeout):
+      raise _PeerUnavailable('timed out')
+    if not self._ok:
+      raise self._value
+    return self._value
+
+
+class _Connection(object):
+  """A client connection to a peer. Requests are pipelined: any number
+  of threads can send requests without waiting for the previous replies,
+  and a reader thread hands every reply to the thread that is waiting
+  for it, matching them by request id.
+
+  Attributes:
+    _write_lock: keeps the frames of concurrent requests from interleaving.
+    _mutex: guards _waiting and closed.
+    _waiting: maps a request id to the _Reply of the waiting thread.
+  """
+
+  def __init__(self, address, timeout):
+    self._socket = socket.socket(_family(address), socket.SOCK_STREAM)
+    try:
+      self._socket.settimeout(timeout)
+      self._socket.connect(address)
+      self._socket.settimeout(None)
+    except socket.error:
+      self._socket.close()
+      raise _PeerUnavailable('cannot connect to {}'.format(_peer_name(address)))
+    self._write_lock = threading.Lock()
+    self._mutex = threading.Lock()
+    self._waiting = {}
+    self._ids = itertools.count()
+    self.closed = False
+    reader = threading.Thread(target=self._read)
+    reader.daemon = True
+    reader.start()
+
+  def request(self, key, timeout):
+    reply = _Reply()
+    with self._mutex:
+      if self.closed:
+        raise _PeerUnavailable('the connection is closed')
+      request_id = next(self._ids)
+      self._waiting[request_id] = reply
+    try:
+      try:
+        with self._write_lock:
+          _send(self._socket, (request_id, key))
+      except socket.error:
+        self.close()
+        raise _PeerUnavailable('the connection is broken')
+      return reply.wait(timeout)
+    finally:
+      with self._mutex:
+        self._waiting.pop(request_id, None)
+
+  def _read(self):
+    try:
+      while True:
+        request_id, ok, value = _recv(self._socket)
+        with self._mutex:
+          reply = self._waiting.pop(request_id, None)
+        if reply is not None:
+          reply.set(ok, value)
+    except Exception:
+      pass
+    self.close()
+
+  def close(self):
+    with self._mutex:
+      if self.closed:
+        return
+      self.closed = True
+      waiting, self._waiting = self._waiting, {}
+    try:
+      self._socket.shutdown(socket.SHUT_RDWR)
+    except socket.error:
+      pass
+    self._socket.close()
+    for reply in waiting.values():
+      reply.set(False, _PeerUnavailable('the connection is closed'))
+
+
+class _Pool(object):
+  """Up to size connections to a peer, handed out round-robin.
+  Broken connections are replaced on demand. Connecting may take the
+  whole timeout when the peer is down, so it's done outside of the mutex,
+  and threads that need a connection at the same time connect at once
+  instead of waiting in line.
+  """
+
+  def __init__(self, address, size, timeout):
+    self._address = address
+    self._size = size
+    self._timeout = timeout
+    self._mutex = threading.Lock()
+    self._connections = []
+    self._next = itertools.count()
+    self._closed = False
+
+  def request(self, key):
+    return self._connection().request(key, self._timeout)
+
+  def _pooled(self):
+    # called with the mutex held
+    self._connections = [connection for connection in self._connections
+                         if not connection.closed]
+    if len(self._connections) < self._size:
+      return None
+    return self._connections[next(self._next) % len(self._connections)]
+
+  def _connection(self):
+    with self._mutex:
+      connection = self._pooled()
+    if connection is not None:
+      return connection
+    connection = _Connection(self._address, self._timeout)
+    with self._mutex:
+      if self._closed:
+        surplus, connection = connection, None
+      else:
+        # others might have filled the pool while we were connecting
+        pooled = self._pooled()
+        if pooled is None:
+          self._connections.append(connection)
+          surplus = None
+        else:
+          surplus, connection = connection, pooled
+    if surplus is not None:
+      surplus.close()
+    if connection is None:
+      raise _PeerUnavailable('the pool is closed')
+    return connection
+
+  def close(self):
+    with self._mutex:
+      self._closed = True
+      connections, self._connections = self._connections, []
+    for connection in connections:
+      connection.close()
+
+
+class _Server(object):
+  """Answers the requests of other peers. Every connection has a reader
+  thread, which hands the requests to a pool of workers, so that a slow
+  load does not hold back the requests pipelined behind it. The pool is
+  bounded: a burst of requests waits in its queue instead of starting
+  a thread per request.
+  """
+
+  def __init__(self, address, handle, workers=16):
+    if futures is None:
+      raise RuntimeError('PeerCache requires concurrent.futures')
+    self._address = address
+    self._handle = handle
+    self._executor = futures.ThreadPoolExecutor(workers)
+    self._mutex = threading.Lock()
+    self._connections = set()
+    self._socket = socket.socket(_family(address), socket.SOCK_STREAM)
+    if not isinstance(address, basestring):
+      self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    self._socket.bind(address)
+    self._socket.listen(128)
+    self._spawn(self._accept)
+
+  @staticmethod
+  def _spawn(target, *args):
+    thread = threading.Thread(target=target, args=args)
+    thread.daemon = True
+    thread.start()
+
+  def _accept(self):
+    while True:
+      try:
+        connection, _ = self._socket.accept()
+      except socket.error:
+        break
+      with self._mutex:
+        self._connections.add(connection)
+      self._spawn(self._serve, connection)
+
+  def _serve(self, connection):
+    write_lock = threading.Lock()
+    try:
+      while True:
+        request_id, key = _recv(connection)
+        self._executor.submit(
+          self._respond, connection, write_lock, request_id, key)
+    except Exception:
+      pass
+    finally:
+      with self._mutex:
+        self._connections.discard(connection)
+      connection.close()
+
+  def _respond(self, connection, write_lock, request_id, key):
+    try:
+      response = (request_id, True, self._handle(key))
+      data = pickle.dumps(response, protocol=_PROTOCOL)
+    except Exception as error:
+      try:
+        data = pickle.dumps((request_id, False, error), protocol=_PROTOCOL)
+      except Exception:
+        # the exception itself cannot be pickled
+        data = pickle.dumps((request_id, False, RuntimeError(repr(error))),
+                            protocol=_PROTOCOL)
+    try:
+      with write_lock:
+        connection.sendall(_HEADER.pack(len(data)) + data)
+    except socket.error:
+      pass
+
+  def close(self):
+    # shutting down wakes up the threads blocked in accept and recv
+    with self._mutex:
+      connections = list(self._connections)
+    for sock in [self._socket] + connections:
+      try:
+        sock.shutdown(socket.SHUT_RDWR)
+      except socket.error:
+        pass
+      sock.close()
+    if isinstance(self._address, basestring) and os.path.exists(self._address):
+      os.unlink(self._address)
+    # the requests in flight are answered to closed sockets, don't wait
+    self._executor.shutdown(wait=False)
+
+
+class PeerCache(object):
+  """One peer of a cache that is partitioned between processes. Every key
+  has an owner, chosen by consistent hashing, which is the only peer that
+  loads and caches it. Other peers fetch the key from the owner and keep
+  a small replica of the keys they read, so the processes on a host share
+  one large cache instead of keeping N copies of a small one.
+
+  A key is loaded once in the whole cluster at a time: concurrent reads
+  are coalesced in every peer, and then again in the owner. If the owner
+  cannot be reached, the key is loaded locally without being cached.
+
+  Peers are addresses: a (host, port) pair for TCP or a path for a Unix
+  socket. Keys and values travel pickled, so peers must trust each other
+  and listen only on local or otherwise protected addresses.
+
+  >>> addresses = ['/tmp/cache-0.sock', '/tmp/cache-1.sock']
+  >>> # in the process number n
+  >>> peer = PeerCache(addresses[n], addresses, loader=load_user)
+  >>> peer.get(42) # loaded by, and cached in, the owner of 42
+
+  Attributes:
+    _cache: the keys this peer owns.
+    _hot: the replica of the keys owned by others.
+    _pools: maps a peer name to the _Pool of connections to it.
+  """
+
+  def __init__(self, address, peers, loader, maxsize=128, expires=None,
+               hot_size=16, connections=2, timeout=5.0, workers=16):
+    """
+    :param address: where this peer listens.
+    :param peers: the addresses of all peers, this one included.
+    :param loader: a callable that takes a key and returns its value.
+    :param maxsize: how many owned keys the peer can keep.
+    :param expires: for how long should owned keys and replicas be kept.
+    :param hot_size: how many keys of other peers to keep, 0 disables it.
+    :param connections: how many connections to open to every other peer.
+    :param timeout: how long, in seconds, to wait for another peer.
+    :param workers: how many requests of other peers to answer at once.
+    """
+    self._name = _peer_name(address)
+    self._addresses = dict((_peer_name(peer), peer) for peer in peers)
+    self._addresses[self._name] = address
+    self._ring = HashRing(sorted(self._addresses))
+    self._loader = loader
+    self._connections = connections
+    self._timeout = timeout
+    self._cache = LruCache(maxsize=maxsize, expires=expires, concurrent=True,
+                           budget=False)
+    if hot_size:
+      self._hot = LruCache(maxsize=hot_size, expires=expires, concurrent=True,
+                           budget=False)
+    self._mutex = threading.Lock()
+    self._pools = {}
+    self._server = _Server(address, self._load, workers)
+
+  def get(self, key):
+    owner = self._ring.owner(key)
+    if owner == self._name:
+      return self._load(key)
+    try:
+      if not hasattr(self, '_hot'):
+        return self._fetch(owner, key)
+      return self._hot.get_or_set(key, lambda: self._fetch(owner, key))
+    except _PeerUnavailable:
+      # a peer that is down or slow must not take the cache down with it.
+      # Only the owner caches the key, a replica would never be invalidated
+      return self._loader(key)
+
+  def __getitem__(self, key):
+    return self.get(key)
+
+  def owner(self, key):
+    """Returns the address of the peer that owns key."""
+    return self._addresses[self._ring.owner(key)]
+
+  def _load(self, key):
+    return self._cache.get_or_set(key, lambda: self._loader(key))
+
+  def _fetch(self, owner, key):
+    with self._mutex:
+      pool = self._pools.get(owner)
+      if pool is None:
+        pool = self._pools[owner] = _Pool(
+          self._addresses[owner], self._connections, self._timeout)
+    return pool.request(key)
+
+  def close(self):
+    """Stops serving other peers and closes the connections to them."""
+    self._server.close()
+    with self._mutex:
+      pools, self._pools = self._pools, {}
+    for pool in pools.values():
+      pool.close()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc_info):
+    self.close()
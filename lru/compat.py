@@ -22,9 +22,30 @@ elif is_py3:
     builtin_str = str
     str = str
     bytes = bytes
+    basestring = (str, bytes)
 
 
 if _ver < (3, 3):
   from monotonic import monotonic
 else:
   from time import monotonic
+
+
+try:
+  from concurrent import futures
+except ImportError:
+  # the `futures` backport is not installed
+  futures = None
+
+
+try:
+  import xxhash
+except ImportError:
+  xxhash = None
+
+
+try:
+  import contextvars
+except ImportError:
+  # Python < 3.7, scopes fall back to threading.local
+  contextvars = None
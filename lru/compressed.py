@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+
+"""An LruCache that keeps large values compressed.
+
+Copyright: (c) 2019 by Vasyl Paliy.
+License: MIT, see LICENSE for more details.
+"""
+
+from __future__ import absolute_import
+
+import importlib
+import sys
+
+from collections import namedtuple
+
+from lru.cache import LruCache, lock
+from lru.compat import basestring, bytes, str
+
+_missing = object()
+
+# a compressed value, text tells whether it has to be decoded from UTF-8
+_Compressed = namedtuple('_Compressed', 'data text')
+
+
+class CompressedCache(LruCache):
+  """An LruCache that compresses bytes and text values of at least
+  threshold bytes when they are added, and decompresses them when
+  they are read. Values that don't shrink are kept as they are.
+
+  Decompressing the same hot value over and over is wasteful, so the
+  last hot_size decompressed values are kept in a small side cache.
+  With maxbytes, the least recently used items are evicted as soon as
+  the stored values (compressed or not) take more than maxbytes, which
+  lets the cache keep many more large values in the same memory.
+
+  >>> cache = CompressedCache(maxsize=10000, maxbytes=64 * 2 ** 20)
+  >>> cache['page'] = json.dumps(document) # compressed
+  >>> cache['page']                        # decompressed
+  >>> cache.nbytes                         # what the values take
+  """
+
+  def __init__(*args, **kwargs):
+    """
+    :param threshold: the size, in bytes, from which values are compressed.
+    :param codec: the name of a module with `compress` and `decompress`
+      functions, such as 'zlib', 'bz2' or 'lzma', or any such object.
+    :param hot_size: how many decompressed values to keep, 0 disables it.
+    :param maxbytes: how many bytes the stored values may take.
+    :param kwargs: the options of LruCache.
+    """
+    if not args:
+      raise ValueError('__init__() needs an argument')
+    self, args = args[0], args[1:]
+    threshold = kwargs.pop('threshold', 1024)
+    codec = kwargs.pop('codec', 'zlib')
+    hot_size = kwargs.pop('hot_size', 32)
+    maxbytes = kwargs.pop('maxbytes', None)
+    try:
+      self._codec
+    except AttributeError:
+      if maxbytes is not None and maxbytes <= 0:
+        raise ValueError('maxbytes should not be less than or equal to 0')
+      self._threshold = threshold
+      self._hot_size = hot_size
+      self._maxbytes = maxbytes
+      self._codec_option = codec
+      if isinstance(codec, basestring):
+        codec = importlib.import_module(codec)
+      self._codec = codec
+      self._bytes = 0
+      if hot_size:
+        # the cleaner thread removes values too, so it's always locked
+        self._decoded = LruCache(maxsize=hot_size, concurrent=True,
+                                 budget=False)
+    super(CompressedCache, self).__init__(*args, **kwargs)
+
+  def _encode(self, value):
+    if isinstance(value, bytes):
+      data, text = value, False
+    elif isinstance(value, str):
+      data, text = value.encode('utf-8'), True
+    else:
+      return value
+    if len(data) < self._threshold:
+      return value
+    compressed = self._codec.compress(data)
+    if len(compressed) >= len(data):
+      return value
+    return _Compressed(compressed, text)
+
+  def _decode(self, key, stored, remember=True):
+    if not isinstance(stored, _Compressed):
+      return stored
+    if hasattr(self, '_decoded'):
+      # the stored value tells whether the decoded one is still current
+      entry = self._decoded.get(key)
+      if entry is not None and entry[0] is stored:
+        return entry[1]
+    value = self._codec.decompress(stored.data)
+    if stored.text:
+      value = value.decode('utf-8')
+    if remember and hasattr(self, '_decoded'):
+      self._decoded[key] = (stored, value)
+    return value
+
+  @staticmethod
+  def _sizeof(stored):
+    if isinstance(stored, _Compressed):
+      return len(stored.data)
+    if isinstance(stored, (bytes, str)):
+      return len(stored)
+    return sys.getsizeof(stored)
+
+  @lock
+  def add(self, key, value, expires=None, tags=None):
+    stored = self._encode(value)
+    size = self._sizeof(stored)
+    if self._maxbytes is not None:
+      old = self._mapping.get(key)
+      if old is not None:
+        # the old value is about to be replaced anyway
+        size -= self._sizeof(old.value)
+      while self._mapping and self._bytes + size > self._maxbytes:
+        node = self._root.prev
+        if node.key == key:
+          break
+        self._evict(node)
+    super(CompressedCache, self).add(key, stored, expires=expires, tags=tags)
+    self._bytes += self._sizeof(stored)
+
+  def get(self, key, default=None):
+    stored = super(CompressedCache, self).get(key, _missing)
+    if stored is _missing:
+      return default
+    return self._decode(key, stored)
+
+  def _peek(self, key, default=None):
+    stored = super(CompressedCache, self)._peek(key, _missing)
+    if stored is _missing:
+      return default
+    return self._decode(key, stored)
+
+  def get_many(self, keys, default=None):
+    values = super(CompressedCache, self).get_many(keys, _missing)
+    return [default if stored is _missing else self._decode(key, stored)
+            for key, stored in zip(keys, values)]
+
+  @lock
+  def __delitem__(self, key):
+    node = self._mapping.get(key)
+    super(CompressedCache, self).__delitem__(key)
+    self._bytes -= self._sizeof(node.value)
+    if hasattr(self, '_decoded'):
+      self._decoded.pop(key, None)
+
+  def values(self):
+    # a full scan should not flush the hot values out of the side cache
+    return [self._decode(key, stored, remember=False)
+            for key, stored in super(CompressedCache, self).items()]
+
+  def items(self):
+    return [(key, self._decode(key, stored, remember=False))
+            for key, stored in super(CompressedCache, self).items()]
+
+  @property
+  def nbytes(self):
+    """How many bytes the stored values take, as counted against maxbytes."""
+    return self._bytes
+
+  def __getstate__(self):
+    state = super(CompressedCache, self).__getstate__()
+    state.update(threshold=self._threshold, codec=self._codec_option,
+                 hot_size=self._hot_size, maxbytes=self._maxbytes)
+    return state
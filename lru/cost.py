@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+
+"""Cost-aware eviction (GreedyDual-Size).
+
+Copyright: (c) 2019 by Vasyl Paliy.
+License: MIT, see LICENSE for more details.
+"""
+
+from __future__ import absolute_import
+
+import heapq
+import itertools
+
+from lru.cache import LruCache, lock
+from lru.compat import monotonic
+
+
+class CostAwareCache(LruCache):
+  """An LruCache that evicts the items that are cheapest to lose instead
+  of the least recently used ones, using the GreedyDual-Size algorithm.
+
+  Every item has a cost, the time it took to compute it, and a size.
+  Its priority is L + cost / size, where L is the priority of the last
+  evicted item. The item with the lowest priority is evicted, and a hit
+  refreshes the priority with the current L. Thus expensive items stay
+  longer, but an expensive item that is no longer used is eventually
+  overtaken by L and evicted. When all costs are equal, it's plain LRU.
+
+  `get_or_set` measures how long the loader takes, and `add` takes
+  the cost explicitly, items added without a cost cost nothing.
+
+  >>> cache = CostAwareCache(maxsize=1000)
+  >>> cache.get_or_set('report', build_report) # the cost is measured
+  >>> cache.add('total', total, cost=0.5)
+  >>> cache.saved # seconds of computation saved by hits
+
+  Attributes:
+    _costs: maps a key to a (cost, size) pair.
+    _priorities: maps a key to the sequence number of its current entry
+      in the heap, older entries of the key are skipped.
+    _heap: a min-heap of (priority, sequence number, key) entries.
+    _inflation: L, the priority of the last evicted item.
+    _measured: the costs measured by `get_or_set`, picked up by `add`.
+  """
+
+  def __init__(*args, **kwargs):
+    """
+    :param sizeof: a callable that returns the size of a value, e.g. len.
+      Without it, every item has the size of 1 and only the cost matters.
+    :param kwargs: the options of LruCache.
+    """
+    if not args:
+      raise ValueError('__init__() needs an argument')
+    self, args = args[0], args[1:]
+    sizeof = kwargs.pop('sizeof', None)
+    try:
+      self._costs
+    except AttributeError:
+      self._sizeof = sizeof
+      self._costs = {}
+      self._priorities = {}
+      self._heap = []
+      self._counter = itertools.count()
+      self._inflation = 0.0
+      self._measured = {}
+      self._saved = 0.0
+    super(CostAwareCache, self).__init__(*args, **kwargs)
+
+  @lock
+  def add(self, key, value, expires=None, tags=None, cost=None):
+    """Adds a key-value pair to the cache, see `LruCache.add`.
+
+    :param cost: how expensive the value is to recompute, in seconds.
+    """
+    if cost is None:
+      cost = self._measured.pop(key, 0.0)
+    super(CostAwareCache, self).add(key, value, expires=expires, tags=tags)
+    size = self._sizeof(value) if self._sizeof is not None else 1
+    self._costs[key] = (cost, max(size, 1))
+    self._prioritize(key)
+
+  def get_or_set(self, key, loader, expires=None, tags=None):
+    def _timed_loader():
+      start = monotonic()
+      value = loader()
+      # `add` is called right after, under the same key lock
+      self._measured[key] = monotonic() - start
+      return value
+    try:
+      return super(CostAwareCache, self).get_or_set(
+        key, _timed_loader, expires=expires, tags=tags)
+    finally:
+      self._measured.pop(key, None)
+
+  def _prioritize(self, key):
+    cost, size = self._costs[key]
+    sequence = next(self._counter)
+    self._priorities[key] = sequence
+    heapq.heappush(self._heap, (self._inflation + cost / size, sequence, key))
+    # every hit leaves an outdated entry behind
+    if len(self._heap) > 2 * len(self._priorities) + 64:
+      self._heap = [entry for entry in self._heap
+                    if self._priorities.get(entry[2]) == entry[1]]
+      heapq.heapify(self._heap)
+
+  def _bump_up(self, node):
+    super(CostAwareCache, self)._bump_up(node)
+    self._saved += self._costs[node.key][0]
+    self._prioritize(node.key)
+
+  def _next_victim(self):
+    heap = self._heap
+    while heap:
+      priority, sequence, key = heapq.heappop(heap)
+      if self._priorities.get(key) == sequence:
+        self._inflation = priority
+        return self._mapping[key]
+    return super(CostAwareCache, self)._next_victim()
+
+  @lock
+  def __delitem__(self, key):
+    super(CostAwareCache, self).__delitem__(key)
+    del self._costs[key]
+    del self._priorities[key]
+
+  @property
+  def saved(self):
+    """The total cost of the hits, i.e. the time the cache has saved."""
+    return self._saved
+
+  def cost(self, key):
+    """Returns the cost of key, or None if the key is not cached."""
+    return self._costs.get(key, (None,))[0]
+
+  def __getstate__(self):
+    state = super(CostAwareCache, self).__getstate__()
+    state['sizeof'] = self._sizeof
+    return state
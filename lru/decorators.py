@@ -5,28 +5,123 @@ Copyright: (c) 2019 by Vasyl Paliy.
 License: MIT, see LICENSE for more details.
 """
 
+import hashlib
+import importlib
+import threading
 import time
 import pickle
+import weakref
 
 from hashlib import sha1
 from collections import namedtuple
 from functools import wraps
 
 from lru import LruCache
-from lru.compat import monotonic
+from lru.clock import default_clock
+from lru.compat import futures, monotonic, xxhash
+from lru.cost import CostAwareCache
+
+_missing = object()
+
+
+# buffers smaller than this are hashed on every call
+_DIGEST_CACHE_THRESHOLD = 1 << 16
+
+# id of an immutable buffer -> (weak reference, key)
+_digests = {}
+
+_BufferKey = namedtuple('BufferKey', 'type format shape digest')
+
+
+def _hash_buffer(view):
+  """Hashes a contiguous buffer without copying it."""
+  if xxhash is not None:
+    return xxhash.xxh3_128_hexdigest(view)
+  if hasattr(hashlib, 'blake2b'):
+    return hashlib.blake2b(view, digest_size=16).hexdigest()
+  return sha1(view).hexdigest()
+
+
+def _is_frozen(obj):
+  """Checks whether the contents of a buffer can never change,
+  which is the case only for read-only views of bytes objects.
+  """
+  while not isinstance(obj, bytes):
+    if isinstance(obj, memoryview):
+      if not obj.readonly:
+        return False
+      obj = obj.obj
+    elif hasattr(obj, 'flags') and hasattr(obj, 'base'):
+      # a NumPy array that owns its data can be made writeable again
+      if obj.flags.writeable or obj.base is None:
+        return False
+      obj = obj.base
+    else:
+      return False
+  return True
+
+
+def _buffer_key(obj):
+  """Generates a key for an object that supports the buffer protocol
+  (bytes, memoryview, NumPy arrays, etc) out of the hash of its
+  contents and its metadata. Returns None if obj isn't a buffer.
+  """
+  entry = _digests.get(id(obj))
+  if entry is not None and entry[0]() is obj:
+    return entry[1]
+  dtype = getattr(obj, 'dtype', None)
+  if getattr(dtype, 'hasobject', False):
+    # the buffer of an object array is a bunch of pointers
+    return None
+  try:
+    view = memoryview(obj)
+  except (TypeError, ValueError):
+    # e.g. datetime arrays don't export buffers
+    if dtype is None:
+      return None
+    view = memoryview(obj.tobytes())
+  shape = getattr(obj, 'shape', view.shape)
+  dtype = str(getattr(obj, 'dtype', view.format))
+  if not view.contiguous:
+    view = memoryview(view.tobytes())
+  elif view.ndim != 1 or view.format != 'B':
+    view = view.cast('B')
+  key = _BufferKey(type(obj).__name__, dtype, shape, _hash_buffer(view))
+  if view.nbytes >= _DIGEST_CACHE_THRESHOLD and _is_frozen(obj):
+    # hash every immutable buffer only once for as long as it is alive
+    ident = id(obj)
+    try:
+      ref = weakref.ref(obj, lambda ref: _digests.pop(ident, None))
+    except TypeError:
+      # bytes objects can't be weakly referenced
+      return key
+    _digests[ident] = (ref, key)
+  return key
+
+
+def _arg_key(arg):
+  """Replaces a buffer argument with the key of its contents.
+  Other arguments are left as is.
+  """
+  if isinstance(arg, (bytes, bytearray, memoryview)) or \
+      hasattr(arg, '__array_interface__'):
+    key = _buffer_key(arg)
+    if key is not None:
+      return key
+  return arg
 
 
 def _get_key(function, args, kwargs):
   """Generates a key for a function with its arguments."""
-  key = str(args)
+  key = str(tuple(_arg_key(arg) for arg in args))
   if kwargs:
-    for item in kwargs.items():
-      key += str(item)
+    for name, value in kwargs.items():
+      key += str((name, _arg_key(value)))
   seed = pickle.dumps((function.__name__, key))
   return sha1(seed).hexdigest()
 
 
-def lru_cache(maxsize=128, expires=10*60):
+def lru_cache(maxsize=128, expires=10*60, clock=None, cost_aware=False):
   """
   A memoized function, backed by an LRU cache.
   Supports data expiration.
@@ -62,26 +157,329 @@ def lru_cache(maxsize=128, expires=10*60):
   >>> f(5)
   function(5)
   5
+
+  :param clock: the time source for expiration, see `lru.clock`.
+  :param cost_aware: whether to evict the results that were the fastest
+    to compute instead of the least recently used ones, see `CostAwareCache`.
   """
   # create a single cache per function that is being decorated
-  cache = LruCache(capacity=maxsize, expires=expires)
+  cache_class = CostAwareCache if cost_aware else LruCache
+  cache = cache_class(maxsize=maxsize, expires=expires, clock=clock)
   def _lru(function):
     @wraps(function)
     def _lru_wrapper(*args, **kwargs):
       # generate the key
       key = _get_key(function, args, kwargs)
-      if key in cache:
-        return cache[key]
-      result = function(*args, **kwargs)
-      cache[key] = result
-      return result
+      return cache.get_or_set(key, lambda: function(*args, **kwargs))
     return _lru_wrapper
   return _lru
 
 
-def _is_stale(entry, time_limit):
+def _call_unwrapped(module, name, args, kwargs):
+  """Runs a decorated function in a worker process.
+  The decorated function can't be pickled by reference because
+  the module attribute is the wrapper, so we look the function
+  up by name and call what the wrapper wraps.
+  """
+  function = importlib.import_module(module)
+  for attribute in name.split('.'):
+    function = getattr(function, attribute)
+  function = getattr(function, '__wrapped__', function)
+  return function(*args, **kwargs)
+
+
+def process_cache(maxsize=128, expires=10*60, max_workers=None, executor=None,
+                  clock=None, cost_aware=False):
+  """
+  A memoized function, backed by an LRU cache, that computes
+  misses in a pool of worker processes while the cache stays
+  in the calling process. Concurrent misses for the same arguments
+  are computed only once. The function has to be defined at the
+  top level of a module, and its arguments must be picklable.
+
+  >>> @process_cache(maxsize=128, expires=60)
+  ... def function(x):
+  ...    return x ** x
+  >>> function(10)
+  10000000000
+  >>> function.map([10, 11, 12]) # only 11 and 12 are sent to the pool
+  [10000000000, 285311670611, 8916100448256]
+  >>> function.shutdown()
+
+  :param max_workers: the size of the process pool, if it's created here.
+  :param executor: an executor to submit misses to instead of
+    a process pool owned by the decorator.
+  :param clock: the time source for expiration, see `lru.clock`.
+  :param cost_aware: whether to evict the results that were the fastest
+    to compute instead of the least recently used ones, see `CostAwareCache`.
+    The cost includes the time a call has waited for a free worker.
+  """
+  if executor is None and futures is None:
+    raise RuntimeError('process_cache requires concurrent.futures')
+  cache_class = CostAwareCache if cost_aware else LruCache
+  cache = cache_class(maxsize=maxsize, expires=expires, concurrent=True,
+                      clock=clock)
+  def _process_cache(function):
+    # futures of the misses that are being computed right now
+    pending = {}
+    mutex = threading.Lock()
+    # owned executor, if any, created lazily
+    state = {'executor': executor}
+    name = getattr(function, '__qualname__', function.__name__)
+
+    def _get_executor():
+      if state['executor'] is None:
+        state['executor'] = futures.ProcessPoolExecutor(max_workers)
+        state['owned'] = True
+      return state['executor']
+
+    def _on_done(key, future, started):
+      try:
+        # None can't be cached, `_result` raises for it instead
+        if (not future.cancelled() and future.exception() is None and
+            future.result() is not None):
+          if cost_aware:
+            cache.add(key, future.result(), cost=monotonic() - started)
+          else:
+            cache[key] = future.result()
+      finally:
+        with mutex:
+          pending.pop(key, None)
+
+    def _result(future):
+      # the same error as `lru_cache` gets from the cache
+      value = future.result()
+      if value is None:
+        raise ValueError('Key and value must not be None')
+      return value
+
+    def _submit(key, args, kwargs):
+      with mutex:
+        future = pending.get(key)
+        if future is not None:
+          return future
+        # the key might have been cached since we last looked
+        value = cache.get(key, _missing)
+        if value is not _missing:
+          future = futures.Future()
+          future.set_result(value)
+          return future
+        started = monotonic()
+        future = pending[key] = _get_executor().submit(
+          _call_unwrapped, function.__module__, name, args, kwargs)
+      future.add_done_callback(lambda future: _on_done(key, future, started))
+      return future
+
+    @wraps(function)
+    def _process_cache_wrapper(*args, **kwargs):
+      key = _get_key(function, args, kwargs)
+      value = cache.get(key, _missing)
+      if value is not _missing:
+        return value
+      return _result(_submit(key, args, kwargs))
+
+    def _map(*iterables):
+      """Like the built-in `map`, but fans out only
+      the missing arguments to the pool at once.
+      """
+      results, misses = [], []
+      for args in zip(*iterables):
+        key = _get_key(function, args, {})
+        value = cache.get(key, _missing)
+        if value is _missing:
+          misses.append((len(results), _submit(key, args, {})))
+        results.append(value)
+      for index, future in misses:
+        results[index] = _result(future)
+      return results
+
+    def _shutdown(wait=True):
+      """Shuts down the process pool if it's owned by the decorator."""
+      if state.pop('owned', False):
+        state.pop('executor').shutdown(wait=wait)
+        state['executor'] = None
+
+    _process_cache_wrapper.map = _map
+    _process_cache_wrapper.shutdown = _shutdown
+    return _process_cache_wrapper
+  return _process_cache
+
+
+def _element_key(element):
+  """Generates a key for a single element of a batch."""
+  if getattr(element, 'ndim', 0):
+    # a row of a multidimensional array isn't hashable
+    key = _buffer_key(element)
+    if key is not None:
+      return key
+  try:
+    hash(element)
+  except TypeError:
+    return str(element)
+  return element
+
+
+def _take(inputs, indexes):
+  """Picks the elements at indexes, preserving the type of the batch."""
+  if hasattr(inputs, '__array__'):
+    # fancy indexing on NumPy arrays
+    return inputs[indexes]
+  elements = [inputs[index] for index in indexes]
+  return tuple(elements) if isinstance(inputs, tuple) else elements
+
+
+def _assemble(inputs, results):
+  """Builds the output batch out of per-element results."""
+  if hasattr(inputs, '__array__'):
+    from numpy import asarray
+    return asarray(results)
+  return tuple(results) if isinstance(inputs, tuple) else results
+
+
+def batch_cache(maxsize=128, expires=10*60, clock=None, cost_aware=False):
+  """
+  A memoized vectorized function, backed by an LRU cache.
+  The function takes a batch of inputs (a list, a tuple or a NumPy array)
+  as its first argument and returns a batch of results of the same length.
+  Every element is cached on its own, and the function is called once
+  with only the missing elements. The rest of the arguments are shared by
+  all elements of the batch.
+
+  >>> @batch_cache(maxsize=1024, expires=60)
+  ... def function(xs):
+  ...    print "function(" + str(xs) + ")"
+  ...    return [x * 2 for x in xs]
+  >>> function([1, 2, 3])
+  function([1, 2, 3])
+  [2, 4, 6]
+  >>> function([3, 4, 1])
+  function([4])
+  [6, 8, 2]
+
+  :param clock: the time source for expiration, see `lru.clock`.
+  :param cost_aware: whether to evict the results that were the fastest
+    to compute instead of the least recently used ones, see `CostAwareCache`.
+    Every element of a batch costs an equal share of the call.
+  """
+  cache_class = CostAwareCache if cost_aware else LruCache
+  cache = cache_class(maxsize=maxsize, expires=expires, clock=clock)
+  def _batch_cache(function):
+    @wraps(function)
+    def _batch_cache_wrapper(inputs, *args, **kwargs):
+      prefix = _get_key(function, args, kwargs)
+      keys = [(prefix, _element_key(element)) for element in inputs]
+      results = cache.get_many(keys, _missing)
+      missing = [index for index, result in enumerate(results)
+                 if result is _missing]
+      if missing:
+        started = monotonic()
+        computed = function(_take(inputs, missing), *args, **kwargs)
+        cost = (monotonic() - started) / len(missing)
+        if len(computed) != len(missing):
+          raise ValueError('Expected {} results, got {}'.format(
+            len(missing), len(computed)))
+        for index, result in zip(missing, computed):
+          results[index] = result
+        added = [(keys[index], results[index]) for index in missing
+                 if results[index] is not None]
+        if cost_aware:
+          for key, result in added:
+            cache.add(key, result, cost=cost)
+        else:
+          cache.update(added)
+      return _assemble(inputs, results)
+    return _batch_cache_wrapper
+  return _batch_cache
+
+
+class _Recording(object):
+  """The items an iterator has produced so far, shared by every consumer
+  of the same call. Whoever reaches the end of the recording first pulls
+  the next item from the iterator, everybody else replays the items.
+
+  Attributes:
+    _lock: lets only one consumer advance the iterator at a time.
+    _items: the recorded items.
+    _done: whether the iterator has been exhausted or has failed.
+    _error: the exception the iterator has failed with, if any.
+  """
+
+  def __init__(self, iterator, on_error):
+    self._iterator = iterator
+    self._on_error = on_error
+    self._lock = threading.Lock()
+    self._items = []
+    self._done = False
+    self._error = None
+
+  def __iter__(self):
+    items, index = self._items, 0
+    while True:
+      if index < len(items):
+        yield items[index]
+        index += 1
+        continue
+      with self._lock:
+        if index < len(items):
+          # another consumer has pulled it while we were waiting
+          continue
+        if not self._done:
+          try:
+            items.append(next(self._iterator))
+            continue
+          except StopIteration:
+            self._done = True
+          except Exception as error:
+            self._done, self._error = True, error
+            self._on_error(self)
+        error = self._error
+      if error is not None:
+        raise error
+      return
+
+
+def stream_cache(maxsize=128, expires=10*60, clock=None):
+  """
+  A memoized generator function (or any function returning an iterator),
+  backed by an LRU cache. The items are recorded as they are consumed,
+  so the first consumer streams them from the function, and any other
+  consumer, concurrent or later, replays the recorded items and then
+  continues the same live iterator. A stream that has been consumed only
+  partially is cached up to that point. If the iterator fails, the
+  recording is dropped and the next call starts over.
+
+  >>> @stream_cache(maxsize=16, expires=60)
+  ... def rows(query):
+  ...    print "rows(" + query + ")"
+  ...    for row in database.execute(query):
+  ...      yield row
+  >>> next(rows('SELECT ...'))
+  rows(SELECT ...)
+  (1, 'foo')
+  >>> list(rows('SELECT ...')) # the first row is replayed, the rest is live
+  [(1, 'foo'), (2, 'bar')]
+
+  :param clock: the time source for expiration, see `lru.clock`.
+  """
+  cache = LruCache(maxsize=maxsize, expires=expires, concurrent=True,
+                   clock=clock)
+  def _stream_cache(function):
+    @wraps(function)
+    def _stream_cache_wrapper(*args, **kwargs):
+      key = _get_key(function, args, kwargs)
+      def _on_error(recording):
+        if cache.get(key) is recording:
+          cache.pop(key, None)
+      recording = cache.get_or_set(key, lambda: _Recording(
+        iter(function(*args, **kwargs)), _on_error))
+      return iter(recording)
+    return _stream_cache_wrapper
+  return _stream_cache
+
+
+def _is_stale(entry, time_limit, clock=default_clock):
   # check if the current entry has expired
-  return (monotonic() - entry.time) > time_limit
+  return (clock.now() - entry.time) > time_limit
 
 
 def _get_lazy_cache():
@@ -90,7 +488,7 @@ def _get_lazy_cache():
 _Entry = namedtuple('Entry', 'value time')
 
 
-def lazy_cache(maxsize=128, expires=10*60):
+def lazy_cache(maxsize=128, expires=10*60, clock=None):
   """
   A memoized function that supports data expiration.
   >>> @lazy_cache(maxsize=128, expires=10)
@@ -116,21 +514,24 @@ def lazy_cache(maxsize=128, expires=10*60):
   >>> f(5) # same thing for 5
   function(5)
   5
+
+  :param clock: the time source for expiration, see `lru.clock`.
   """
   # for testing purposes
   cache = _get_lazy_cache()
+  clock = clock or default_clock
   def _lazy_cache(function):
     @wraps(function)
     def _lazy_cache_wrapper(*args, **kwargs):
       key = _get_key(function, args, kwargs)
       if key in cache:
-        if not _is_stale(cache[key], expires):
+        if not _is_stale(cache[key], expires, clock):
           return cache[key].value
         del cache[key]
       if len(cache) > maxsize:
         cache.clear()
       result = function(*args, **kwargs)
-      cache[key] = _Entry(result, monotonic() + expires)
+      cache[key] = _Entry(result, clock.now() + expires)
       return result
     return _lazy_cache_wrapper
   return _lazy_cache
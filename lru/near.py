@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+
+"""Near cache: a process-local LruCache in front of a remote key-value store.
+
+Copyright: (c) 2019 by Vasyl Paliy.
+License: MIT, see LICENSE for more details.
+"""
+
+from __future__ import absolute_import
+
+import threading
+
+from lru.cache import LruCache
+from lru.compat import monotonic
+
+_missing = object()
+
+
+class RemoteBackend(object):
+  """The interface of a remote key-value store. Implement it with
+  a thin adapter around a Redis or memcached client.
+  """
+
+  def get_many(self, keys):
+    """Fetches several keys in a single round trip.
+
+    :return: a dict with the keys that exist in the store.
+    """
+    raise NotImplementedError
+
+  def set(self, key, value, expires=None):
+    raise NotImplementedError
+
+  def delete(self, key):
+    raise NotImplementedError
+
+  def subscribe(self, callback):
+    """Registers callback(key) to be called whenever a key is changed
+    or deleted by any client, e.g. via Redis keyspace notifications.
+    Backends without an invalidation feed don't need to implement it.
+    """
+
+
+class DictBackend(RemoteBackend):
+  """A dict-backed stand-in for a remote store, intended for tests.
+  Changes are published to every subscriber, so several NearCache
+  instances sharing one DictBackend behave like several nodes.
+  """
+
+  def __init__(self):
+    self._lock = threading.Lock()
+    self._data = {}
+    self._subscribers = []
+
+  def get_many(self, keys):
+    now, found = monotonic(), {}
+    with self._lock:
+      for key in keys:
+        value, expires = self._data.get(key, (None, None))
+        if value is not None and (expires is None or expires > now):
+          found[key] = value
+    return found
+
+  def set(self, key, value, expires=None):
+    if expires is not None:
+      expires = monotonic() + expires
+    with self._lock:
+      self._data[key] = (value, expires)
+    self._publish(key)
+
+  def delete(self, key):
+    with self._lock:
+      self._data.pop(key, None)
+    self._publish(key)
+
+  def subscribe(self, callback):
+    self._subscribers.append(callback)
+
+  def _publish(self, key):
+    for callback in list(self._subscribers):
+      callback(key)
+
+
+class _Flight(object):
+  """A fetch from the backend that other threads can wait for.
+
+  Attributes:
+    invalidated: whether the key has been invalidated while being fetched,
+      in which case the fetched value must not be cached.
+  """
+
+  def __init__(self):
+    self._event = threading.Event()
+    self._value = None
+    self._error = None
+    self.invalidated = False
+
+  def set(self, value=None, error=None):
+    self._value, self._error = value, error
+    self._event.set()
+
+  def wait(self):
+    self._event.wait()
+    if self._error is not None:
+      raise self._error
+    return self._value
+
+
+class NearCache(object):
+  """An LruCache (L1) in front of a remote store. Misses are batched into
+  a single `get_many` call to the backend, and concurrent fetches of the
+  same key are coalesced. Entries are evicted from L1 when the backend
+  reports that a key has changed, or when `invalidate` is called by
+  whatever delivers invalidation messages.
+
+  >>> cache = NearCache(RedisBackend(client), maxsize=10000, expires=300)
+  >>> cache.get_many(['a', 'b'])
+  {'a': 1}
+  >>> cache.set('b', 2)
+
+  Attributes:
+    _local: the process-local cache.
+    _mutex: guards the fetches in flight and orders them with invalidations.
+    _flights: maps a key to the _Flight that is fetching it.
+  """
+
+  def __init__(self, backend, maxsize=128, expires=None, subscribe=True):
+    """
+    :param backend: a RemoteBackend implementation.
+    :param maxsize: how many items the local cache can keep.
+    :param expires: for how long the local cache retains items,
+      a safety net in case an invalidation message is lost.
+    :param subscribe: whether to listen to the backend's invalidation feed.
+    """
+    self._backend = backend
+    self._local = LruCache(maxsize=maxsize, expires=expires, concurrent=True,
+                           budget=False)
+    self._mutex = threading.Lock()
+    self._flights = {}
+    if subscribe:
+      backend.subscribe(self.invalidate)
+
+  def get(self, key, default=None):
+    value = self._local.get(key, _missing)
+    if value is _missing:
+      value = self.get_many([key]).get(key, default)
+    return value
+
+  def get_many(self, keys):
+    """Returns a dict with the keys that exist, asking the backend
+    only for the keys that are neither cached locally nor being
+    fetched by another thread.
+    """
+    found, missing = {}, []
+    for key, value in zip(keys, self._local.get_many(keys, _missing)):
+      if value is _missing:
+        missing.append(key)
+      else:
+        found[key] = value
+    if not missing:
+      return found
+    fetching, waiting, mine = [], [], set()
+    with self._mutex:
+      for key in missing:
+        flight = self._flights.get(key)
+        if flight is None:
+          flight = self._flights[key] = _Flight()
+          fetching.append((key, flight))
+          mine.add(key)
+        elif key not in mine:
+          waiting.append((key, flight))
+    if fetching:
+      self._fetch(fetching, found)
+    for key, flight in waiting:
+      value = flight.wait()
+      if value is not None:
+        found[key] = value
+    return found
+
+  def _fetch(self, fetching, found):
+    try:
+      fetched = self._backend.get_many([key for key, _ in fetching])
+    except Exception as error:
+      with self._mutex:
+        for key, flight in fetching:
+          del self._flights[key]
+          flight.set(error=error)
+      raise
+    with self._mutex:
+      for key, flight in fetching:
+        value = fetched.get(key)
+        if value is not None:
+          found[key] = value
+          # an invalidation might have arrived during the round trip
+          if not flight.invalidated:
+            self._local[key] = value
+        del self._flights[key]
+        flight.set(value)
+
+  def set(self, key, value, expires=None):
+    """Writes through to the backend and drops the local copy."""
+    self._backend.set(key, value, expires=expires)
+    self.invalidate(key)
+
+  def delete(self, key):
+    self._backend.delete(key)
+    self.invalidate(key)
+
+  def invalidate(self, key):
+    """Evicts key from the local cache. This is the hook
+    for invalidation messages coming from other nodes.
+    """
+    with self._mutex:
+      flight = self._flights.get(key)
+      if flight is not None:
+        flight.invalidated = True
+      self._local.pop(key, None)
+
+  def __contains__(self, key):
+    return self.get(key, _missing) is not _missing
+
+  def __len__(self):
+    """The number of locally cached items."""
+    return len(self._local)
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+
+"""A request-scoped cache in front of a shared LruCache.
+
+Copyright: (c) 2019 by Vasyl Paliy.
+License: MIT, see LICENSE for more details.
+"""
+
+from __future__ import absolute_import
+
+import sys
+import threading
+
+from contextlib import contextmanager
+from functools import wraps
+
+from lru.compat import contextvars
+
+if sys.version_info >= (3, 5):
+  from inspect import iscoroutinefunction
+  from lru._async import scoped_coroutine
+else:
+  # there are no coroutine functions to wrap
+  iscoroutinefunction = None
+
+_missing = object()
+# remembers within a scope that the shared cache doesn't have a key
+_absent = object()
+
+
+class _ThreadLocalVar(object):
+  """The part of the ContextVar interface that ScopedCache needs,
+  for Pythons without contextvars. Scopes are per thread then,
+  which is not enough to tell apart asyncio tasks.
+  """
+
+  def __init__(self, name):
+    self._local = threading.local()
+
+  def get(self, default=None):
+    return getattr(self._local, 'value', default)
+
+  def set(self, value):
+    token = self.get()
+    self._local.value = value
+    return token
+
+  def reset(self, token):
+    self._local.value = token
+
+
+class ScopedCache(object):
+  """Serves repeated reads within a scope (a request, a task) from a plain
+  dict, so that only the first read of a key takes the lock of the shared
+  cache. Misses fall through to the shared cache, and the dict is thrown
+  away when the scope exits. Outside of a scope, every call goes straight
+  to the shared cache.
+
+  The scope lives in a context variable, so every thread and every asyncio
+  task has its own. Tasks created inside a scope share it with their parent.
+  Within a scope, a key keeps the value it had when it was first read,
+  unless it is changed through this ScopedCache.
+
+  >>> shared = LruCache(maxsize=10000, concurrent=True)
+  >>> cache = ScopedCache(shared)
+  >>> with cache.scope():
+  ...   cache.get('user:42') # takes the lock of the shared cache
+  ...   cache.get('user:42') # doesn't
+
+  >>> @cache # a scope per call, works for coroutine functions too
+  ... def handle(request):
+  ...   ...
+  """
+
+  def __init__(self, cache):
+    """
+    :param cache: the shared cache, usually a concurrent LruCache.
+    """
+    self._cache = cache
+    name = 'lru_scope_{}'.format(id(self))
+    if contextvars is not None:
+      self._scope = contextvars.ContextVar(name, default=None)
+    else:
+      self._scope = _ThreadLocalVar(name)
+
+  @contextmanager
+  def scope(self):
+    """Starts a scope, or joins the current one if there is one."""
+    if self._scope.get() is not None:
+      yield
+      return
+    token = self._scope.set({})
+    try:
+      yield
+    finally:
+      self._scope.reset(token)
+
+  def __call__(self, function):
+    """Runs every call of function in a scope."""
+    if iscoroutinefunction is not None and iscoroutinefunction(function):
+      return scoped_coroutine(self.scope, function)
+
+    @wraps(function)
+    def _scoped(*args, **kwargs):
+      with self.scope():
+        return function(*args, **kwargs)
+    return _scoped
+
+  @property
+  def in_scope(self):
+    return self._scope.get() is not None
+
+  def get(self, key, default=None):
+    local = self._scope.get()
+    if local is None:
+      return self._cache.get(key, default)
+    value = local.get(key, _missing)
+    if value is _missing:
+      value = local[key] = self._cache.get(key, _absent)
+    return default if value is _absent else value
+
+  def __getitem__(self, key):
+    value = self.get(key, _missing)
+    if value is _missing:
+      raise KeyError(key)
+    return value
+
+  def __contains__(self, key):
+    return self.get(key, _missing) is not _missing
+
+  def get_many(self, keys, default=None):
+    """Looks up the keys that are not in the scope all at once."""
+    local = self._scope.get()
+    if local is None:
+      return self._cache.get_many(keys, default)
+    missing = [key for key in keys if key not in local]
+    if missing:
+      local.update(zip(missing, self._cache.get_many(missing, _absent)))
+    values = [local[key] for key in keys]
+    return [default if value is _absent else value for value in values]
+
+  def get_or_set(self, key, loader, expires=None, tags=None):
+    local = self._scope.get()
+    value = _missing if local is None else local.get(key, _missing)
+    if value is _missing or value is _absent:
+      value = self._cache.get_or_set(key, loader, expires=expires, tags=tags)
+      if local is not None:
+        local[key] = value
+    return value
+
+  def add(self, key, value, expires=None, tags=None):
+    self._cache.add(key, value, expires=expires, tags=tags)
+    local = self._scope.get()
+    if local is not None:
+      local[key] = value
+
+  def __setitem__(self, key, value):
+    self.add(key, value)
+
+  def __delitem__(self, key):
+    local = self._scope.get()
+    if local is not None:
+      local[key] = _absent
+    del self._cache[key]
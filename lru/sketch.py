@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+
+"""Space-Saving heavy hitter tracking.
+
+Copyright: (c) 2019 by Vasyl Paliy.
+License: MIT, see LICENSE for more details.
+"""
+
+from __future__ import absolute_import
+
+from collections import namedtuple
+
+HeavyHitter = namedtuple('HeavyHitter', 'key count error')
+
+
+class _Bucket(object):
+  """Groups the counters that have the same count. Buckets form
+  a doubly linked list sorted by count, the smallest one first.
+  """
+
+  __slots__ = ('count', 'counters', 'next', 'prev')
+
+  def __init__(self, count, next=None, prev=None):
+    self.count = count
+    self.counters = {}
+    self.next = next
+    self.prev = prev
+
+
+class _Counter(object):
+  __slots__ = ('key', 'error', 'bucket')
+
+  def __init__(self, key, error, bucket):
+    self.key = key
+    self.error = error
+    self.bucket = bucket
+
+
+class SpaceSaving(object):
+  """Keeps an approximate top-k of the most frequent keys in a stream
+  using at most capacity counters (the Space-Saving algorithm with the
+  Stream-Summary structure). Every `offer` takes constant time.
+
+  When a new key arrives and all counters are taken, it replaces a key
+  with the smallest count and inherits that count as its error, so the
+  true count of a key is between count - error and count. Any key
+  occurring more than N / capacity times in a stream of N keys is
+  guaranteed to be tracked.
+
+  >>> summary = SpaceSaving(capacity=2)
+  >>> for key in 'aabac':
+  ...   summary.offer(key)
+  >>> summary.top(1)
+  [HeavyHitter(key='a', count=3, error=0)]
+  """
+
+  def __init__(self, capacity=32):
+    if capacity <= 0:
+      raise ValueError('capacity should not be less than or equal to 0')
+    self._capacity = capacity
+    self._counters = {}
+    # the bucket with the smallest count
+    self._head = None
+
+  def offer(self, key):
+    counter = self._counters.get(key)
+    if counter is not None:
+      self._increment(counter)
+    elif len(self._counters) < self._capacity:
+      head = self._head
+      if head is None or head.count != 1:
+        head = self._head = _Bucket(1, next=head)
+        if head.next is not None:
+          head.next.prev = head
+      counter = self._counters[key] = _Counter(key, 0, head)
+      head.counters[key] = counter
+    else:
+      # replace one of the keys with the smallest count
+      head = self._head
+      victim = next(iter(head.counters))
+      counter = head.counters.pop(victim)
+      del self._counters[victim]
+      counter.key, counter.error = key, head.count
+      head.counters[key] = counter
+      self._counters[key] = counter
+      self._increment(counter)
+
+  def _increment(self, counter):
+    bucket = counter.bucket
+    count, following = bucket.count + 1, bucket.next
+    if following is not None and following.count == count:
+      target = following
+    elif len(bucket.counters) == 1:
+      # the bucket would be left empty, reuse it
+      bucket.count = count
+      return
+    else:
+      target = _Bucket(count, next=following, prev=bucket)
+      bucket.next = target
+      if following is not None:
+        following.prev = target
+    del bucket.counters[counter.key]
+    target.counters[counter.key] = counter
+    counter.bucket = target
+    if not bucket.counters:
+      self._unlink(bucket)
+
+  def _unlink(self, bucket):
+    if bucket.prev is None:
+      self._head = bucket.next
+    else:
+      bucket.prev.next = bucket.next
+    if bucket.next is not None:
+      bucket.next.prev = bucket.prev
+
+  def top(self, n=None):
+    """Returns up to n HeavyHitter tuples, the most frequent key first."""
+    counters = sorted(self._counters.values(),
+                      key=lambda counter: counter.bucket.count, reverse=True)
+    return [HeavyHitter(counter.key, counter.bucket.count, counter.error)
+            for counter in counters[:n]]
+
+  def __len__(self):
+    return len(self._counters)
+
+  def clear(self):
+    self._counters = {}
+    self._head = None
+
+
+class HotKeys(object):
+  """A cache observer (see `LruCache.observe`) that tracks
+  the most accessed keys and the keys that miss most often.
+  """
+
+  def __init__(self, capacity=32):
+    self.accessed = SpaceSaving(capacity)
+    self.missed = SpaceSaving(capacity)
+
+  def on_access(self, key, hit):
+    self.accessed.offer(key)
+    if not hit:
+      self.missed.offer(key)
+
+  def on_add(self, key):
+    self.accessed.offer(key)
@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+
+"""An LruCache that keeps bytes values in preallocated slabs.
+
+Copyright: (c) 2019 by Vasyl Paliy.
+License: MIT, see LICENSE for more details.
+"""
+
+from __future__ import absolute_import
+
+import bisect
+
+from collections import OrderedDict
+
+from lru.cache import LruCache, lock
+
+_missing = object()
+
+
+class _Slab(object):
+  """A bytearray cut into chunks of the same size.
+
+  Attributes:
+    size_class: the index of the size class the slab is serving.
+    free: the offsets of the free chunks.
+    used: how many chunks are taken.
+  """
+
+  __slots__ = ('buffer', 'size_class', 'free', 'used')
+
+  def __init__(self, size):
+    self.buffer = bytearray(size)
+    self.size_class = None
+    self.free = []
+    self.used = 0
+
+
+class _SlabAllocator(object):
+  """Hands out chunks of slabs grouped by size class, like memcached.
+  A value goes to the smallest class whose chunks can hold it, so at most
+  1 - 1 / growth_factor of a chunk is wasted. Slabs are allocated up to
+  maxbytes, after that the only way to get a slab for another class is
+  to wait until one is completely free.
+
+  Attributes:
+    _sizes: the chunk size of every class, ascending.
+    _available: for every class, the slabs that have free chunks.
+    _empty: the slabs without a single chunk taken, which can be
+      given to any class.
+  """
+
+  def __init__(self, maxbytes, slab_size, min_chunk, growth_factor):
+    if slab_size <= 0 or min_chunk <= 0:
+      raise ValueError('slab_size and min_chunk should be greater than 0')
+    if growth_factor <= 1:
+      raise ValueError('growth_factor should be greater than 1')
+    sizes, size = [], min_chunk
+    while size < slab_size:
+      sizes.append(size)
+      # chunks are aligned to 8 bytes
+      size = max(size + 8, int(size * growth_factor + 7) // 8 * 8)
+    sizes.append(slab_size)
+    self._sizes = sizes
+    self._slab_size = slab_size
+    self._max_slabs = max(maxbytes // slab_size, 1)
+    self._slabs = 0
+    self._available = [set() for _ in sizes]
+    self._empty = set()
+
+  def size_class(self, length):
+    """Returns the class that holds values of length bytes."""
+    if length > self._slab_size:
+      raise ValueError(
+        'a value of {} bytes does not fit in a slab of {} bytes'.format(
+          length, self._slab_size))
+    return bisect.bisect_left(self._sizes, length)
+
+  def allocate(self, size_class):
+    """Returns a (slab, offset) pair, or None if there is no room."""
+    available = self._available[size_class]
+    if not available:
+      if self._slabs < self._max_slabs:
+        self._slabs += 1
+        slab = _Slab(self._slab_size)
+      elif self._empty:
+        slab = self._empty.pop()
+        self._available[slab.size_class].discard(slab)
+      else:
+        return None
+      self._assign(slab, size_class)
+    slab = next(iter(available))
+    offset = slab.free.pop()
+    if not slab.used:
+      self._empty.discard(slab)
+    slab.used += 1
+    if not slab.free:
+      available.discard(slab)
+    return slab, offset
+
+  def _assign(self, slab, size_class):
+    size = self._sizes[size_class]
+    slab.size_class = size_class
+    slab.free = list(range(self._slab_size - size, -1, -size))
+    self._available[size_class].add(slab)
+    self._empty.add(slab)
+
+  def free(self, slab, offset):
+    slab.free.append(offset)
+    slab.used -= 1
+    self._available[slab.size_class].add(slab)
+    if not slab.used:
+      self._empty.add(slab)
+
+
+class SlabCache(LruCache):
+  """An LruCache for bytes values, which are copied into large
+  preallocated bytearrays (slabs) instead of being kept as separate
+  objects. Memory use is bounded by maxbytes, no matter how many values
+  come and go, and the chunks of evicted and expired values are reused.
+
+  Values are read as memoryviews of the slabs, without copying them.
+  A view is only valid until its key is changed or removed, after that
+  the chunk may hold another value, so copy it with `bytes(view)` if
+  it has to be kept.
+
+  >>> cache = SlabCache(maxsize=100000, maxbytes=64 * 2 ** 20)
+  >>> cache['foo'] = b'bar'
+  >>> bytes(cache['foo'])
+  b'bar'
+
+  When a class runs out of chunks, its least recently used value is
+  evicted, even if there are older values in other classes.
+
+  Attributes:
+    _classes: for every size class, its keys from the least
+      to the most recently used, so that finding a victim is O(1).
+  """
+
+  def __init__(*args, **kwargs):
+    """
+    :param maxbytes: how much memory all slabs may take.
+    :param slab_size: the size of a slab, and of the largest value.
+    :param min_chunk: the chunk size of the smallest class.
+    :param growth_factor: how much bigger are the chunks of the next class.
+    :param kwargs: the options of LruCache.
+    """
+    if not args:
+      raise ValueError('__init__() needs an argument')
+    self, args = args[0], args[1:]
+    maxbytes = kwargs.pop('maxbytes', 64 * 2 ** 20)
+    slab_size = kwargs.pop('slab_size', 2 ** 20)
+    min_chunk = kwargs.pop('min_chunk', 64)
+    growth_factor = kwargs.pop('growth_factor', 1.25)
+    try:
+      self._allocator
+    except AttributeError:
+      self._allocator = _SlabAllocator(
+        maxbytes, slab_size, min_chunk, growth_factor)
+      self._classes = [OrderedDict() for _ in self._allocator._sizes]
+      self._options = dict(maxbytes=maxbytes, slab_size=slab_size,
+                           min_chunk=min_chunk, growth_factor=growth_factor)
+    super(SlabCache, self).__init__(*args, **kwargs)
+
+  @staticmethod
+  def _view(chunk):
+    slab, offset, length = chunk
+    return memoryview(slab.buffer)[offset:offset + length]
+
+  @lock
+  def add(self, key, value, expires=None, tags=None):
+    if value is None:
+      raise ValueError('Key and value must not be None')
+    data = memoryview(value)
+    if data.ndim != 1 or data.itemsize != 1:
+      data = memoryview(data.tobytes())
+    size_class = self._allocator.size_class(len(data))
+    if key in self._mapping:
+      # the old chunk might be the one we are going to get
+      del self[key]
+    allocation = self._allocator.allocate(size_class)
+    while allocation is None:
+      self._evict(self._victim(size_class))
+      allocation = self._allocator.allocate(size_class)
+    slab, offset = allocation
+    slab.buffer[offset:offset + len(data)] = data
+    try:
+      super(SlabCache, self).add(key, (slab, offset, len(data)),
+                                 expires=expires, tags=tags)
+    except Exception:
+      self._allocator.free(slab, offset)
+      raise
+    self._classes[size_class][key] = None
+
+  def _victim(self, size_class):
+    # the least recently used value of the class, if there are none
+    # the least recently used one, so that a slab becomes free eventually
+    keys = self._classes[size_class]
+    if keys:
+      return self._mapping[next(iter(keys))]
+    return self._root.prev
+
+  def _bump_up(self, node):
+    super(SlabCache, self)._bump_up(node)
+    keys = self._classes[node.value[0].size_class]
+    keys[node.key] = keys.pop(node.key)
+
+  @lock
+  def __delitem__(self, key):
+    slab, offset, _ = self._mapping[key].value
+    super(SlabCache, self).__delitem__(key)
+    del self._classes[slab.size_class][key]
+    self._allocator.free(slab, offset)
+
+  def get(self, key, default=None):
+    chunk = super(SlabCache, self).get(key, _missing)
+    if chunk is _missing:
+      return default
+    return self._view(chunk)
+
+  def _peek(self, key, default=None):
+    chunk = super(SlabCache, self)._peek(key, _missing)
+    if chunk is _missing:
+      return default
+    return self._view(chunk)
+
+  def get_many(self, keys, default=None):
+    chunks = super(SlabCache, self).get_many(keys, _missing)
+    return [default if chunk is _missing else self._view(chunk)
+            for chunk in chunks]
+
+  def values(self):
+    return [self._view(chunk) for chunk in super(SlabCache, self).values()]
+
+  def items(self):
+    return [(key, self._view(chunk))
+            for key, chunk in super(SlabCache, self).items()]
+
+  @lock
+  def __getstate__(self):
+    state = super(SlabCache, self).__getstate__()
+    state['items'] = [(key, self._view(chunk).tobytes(), remaining, tags)
+                      for key, chunk, remaining, tags in state['items']]
+    state.update(self._options)
+    return state
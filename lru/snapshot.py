@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+
+"""A read-mostly cache whose readers never take a lock.
+
+Copyright: (c) 2019 by Vasyl Paliy.
+License: MIT, see LICENSE for more details.
+"""
+
+from __future__ import absolute_import
+
+import threading
+
+from lru.cache import _DEFAULT_CACHE_SIZE
+from lru.compat import monotonic
+
+_missing = object()
+_deleted = object()
+
+
+class SnapshotCache(object):
+  """A cache for data that is read very often and changed rarely,
+  e.g. configuration or feature flags.
+
+  Readers do a plain dict lookup on an immutable snapshot: no lock
+  is taken and no linked list is touched. Writes are staged with `set`
+  and `delete` and become visible all at once when `publish` builds
+  a new snapshot and swaps it in with a single assignment, so a reader
+  sees either all of the changes of a batch or none of them.
+
+  Expiration works like in LruCache, expired items are never returned
+  and they are dropped at the next publish. Recency is tracked
+  approximately with the CLOCK algorithm: every item owns a slot in
+  a byte array, a read sets the slot's reference bit only if it is not
+  set yet, and when the cache is full the clock hand evicts the first
+  item whose bit is clear, clearing the bits it passes.
+
+  >>> cache = SnapshotCache(maxsize=1000, expires=300)
+  >>> cache.set('feature', True)
+  >>> cache.get('feature')
+  >>> cache.publish()
+  >>> cache.get('feature')
+  True
+
+  Attributes:
+    _snapshot: the published dict, maps a key to a (value, expires, slot)
+      tuple. It is never modified once published.
+    _pending: the staged changes, maps a key to a (value, expires) tuple
+      or to _deleted.
+    _referenced: the reference bits, one per slot.
+    _slots: maps a slot to the key it holds, or to _missing.
+    _free: the slots that do not hold any key.
+    _hand: the slot the clock hand points to.
+    _lock: serializes the writers, readers never take it.
+  """
+
+  def __init__(self, items=(), maxsize=_DEFAULT_CACHE_SIZE, expires=None):
+    """
+    :param items: an iterable of key-value pairs, published right away.
+    :param maxsize: how many items can the cache keep.
+    :param expires: for how long should we retain added items.
+    """
+    if maxsize <= 0:
+      raise ValueError('maxsize should not be less than or equal to 0')
+    self._maxsize = maxsize
+    self._expires = expires
+    self._snapshot = {}
+    self._pending = {}
+    self._referenced = bytearray(maxsize)
+    self._slots = [_missing] * maxsize
+    self._free = list(range(maxsize - 1, -1, -1))
+    self._hand = 0
+    self._lock = threading.Lock()
+    if items:
+      for key, value in items:
+        self.set(key, value)
+      self.publish()
+
+  def get(self, key, default=None):
+    entry = self._snapshot.get(key)
+    if entry is None:
+      return default
+    value, expires, slot = entry
+    if expires is not None and expires <= monotonic():
+      return default
+    # a write per read would make the cache line bounce between cores,
+    # so the bit is only written the first time
+    referenced = self._referenced
+    if not referenced[slot]:
+      referenced[slot] = 1
+    return value
+
+  def get_many(self, keys, default=None):
+    """Returns a list with the value of every key, or default for the keys
+    that are not in the cache. All of the values come from the same snapshot.
+    """
+    snapshot, referenced, now = self._snapshot, self._referenced, monotonic()
+    values = []
+    for key in keys:
+      entry = snapshot.get(key)
+      if entry is None or (entry[1] is not None and entry[1] <= now):
+        values.append(default)
+        continue
+      if not referenced[entry[2]]:
+        referenced[entry[2]] = 1
+      values.append(entry[0])
+    return values
+
+  def __getitem__(self, key):
+    value = self.get(key, _missing)
+    if value is _missing:
+      raise KeyError(key)
+    return value
+
+  def __contains__(self, key):
+    return self.get(key, _missing) is not _missing
+
+  def __len__(self):
+    """The number of published items, expired ones included
+    until the next publish."""
+    return len(self._snapshot)
+
+  def keys(self):
+    return list(self._snapshot)
+
+  def set(self, key, value, expires=None):
+    """Stages a key-value pair, it is visible after the next publish.
+
+    :param expires: indicates in how many seconds should the new item
+      expire. If none provided, the default duration (if exists) is used.
+    """
+    if any([key is None, value is None]):
+      raise ValueError('Key and value must not be None')
+    if expires is None:
+      expires = self._expires
+    if expires is not None:
+      expires = monotonic() + expires
+    with self._lock:
+      self._pending[key] = (value, expires)
+
+  def delete(self, key):
+    """Stages the removal of key, it is visible after the next publish."""
+    with self._lock:
+      self._pending[key] = _deleted
+
+  def publish(self):
+    """Applies the staged changes to a copy of the snapshot, drops
+    the expired items, evicts items if the cache is over its maxsize,
+    and swaps the copy in.
+
+    :return: the number of changes that have been published.
+    """
+    with self._lock:
+      pending, self._pending = self._pending, {}
+      now = monotonic()
+      snapshot = {}
+      for key, entry in self._snapshot.items():
+        if entry[1] is not None and entry[1] <= now:
+          self._release(entry[2])
+        else:
+          snapshot[key] = entry
+      for key, change in pending.items():
+        entry = snapshot.pop(key, None)
+        if change is _deleted:
+          if entry is not None:
+            self._release(entry[2])
+          continue
+        value, expires = change
+        if entry is not None:
+          slot = entry[2]
+        elif self._free:
+          slot = self._free.pop()
+        else:
+          slot = self._advance(snapshot)
+        self._slots[slot] = key
+        snapshot[key] = (value, expires, slot)
+      self._snapshot = snapshot
+      return len(pending)
+
+  def _release(self, slot):
+    self._slots[slot] = _missing
+    self._referenced[slot] = 0
+    self._free.append(slot)
+
+  def _advance(self, snapshot):
+    # moves the clock hand to the first slot that hasn't been referenced
+    # since the last sweep, evicts its key and returns the slot
+    referenced, slots, maxsize = self._referenced, self._slots, self._maxsize
+    hand = self._hand
+    while referenced[hand] or slots[hand] not in snapshot:
+      referenced[hand] = 0
+      hand = (hand + 1) % maxsize
+    del snapshot[slots[hand]]
+    self._hand = (hand + 1) % maxsize
+    return hand
+
+  def clear(self):
+    """Removes every item, staged changes included."""
+    with self._lock:
+      self._pending = {}
+      for entry in self._snapshot.values():
+        self._release(entry[2])
+      self._snapshot = {}
@@ -0,0 +1,221 @@
+# -*- coding: future_fstrings -*-
+# -*- coding: utf-8 -*-
+
+"""Write-through and write-behind caching on top of LruCache.
+
+Copyright: (c) 2019 by Vasyl Paliy.
+License: MIT, see LICENSE for more details.
+"""
+
+from __future__ import absolute_import
+
+import atexit
+import threading
+import weakref
+
+from lru.cache import LruCache, lock
+
+_missing = object()
+
+WRITE_THROUGH = 'through'
+WRITE_BEHIND = 'behind'
+
+
+class _Flusher(threading.Thread):
+  """A daemon thread that periodically flushes dirty items of a cache.
+  It is woken up early when enough dirty items have piled up.
+
+  Attributes:
+    _cache_ref: a weak reference to the cache, the thread exits
+      once the cache has been garbage collected.
+    _condition: a condition variable the thread is sleeping on.
+    _interval: for how long to sleep between flushes.
+  """
+
+  daemon = True
+
+  def __init__(self, cache, condition, interval, **kwargs):
+    self._cache_ref = weakref.ref(cache)
+    self._condition = condition
+    self._interval = interval
+    self.stopped = False
+    super(_Flusher, self).__init__(**kwargs)
+
+  def run(self):
+    condition = self._condition
+    while True:
+      with condition:
+        if not self.stopped:
+          condition.wait(self._interval)
+      cache = self._cache_ref()
+      if cache is None or self.stopped:
+        break
+      try:
+        cache.flush()
+      except Exception:
+        # dirty items are kept until the next attempt
+        pass
+      cache = None
+
+
+class WriteBackCache(LruCache):
+  """An LruCache that writes items to a backing store. The store
+  is any object with a `write_many(items)` method, where items
+  is a dict of keys and values to be written in a single batch.
+
+  With the write-through policy, `add` writes the item to the store
+  before caching it. With the write-behind policy, `add` only marks
+  the item as dirty, and a background thread writes dirty items in
+  batches, either every flush_interval seconds or as soon as there are
+  flush_size dirty items. Repeated writes to the same key are coalesced.
+  A dirty item that is about to be evicted or to expire is written first.
+  Dirty items don't depend on being cached, deleting an item from the
+  cache does not cancel its pending write. A forked child starts without
+  dirty items, the ones pending at the time of the fork are left to the parent.
+
+  >>> cache = WriteBackCache(store, maxsize=1000, flush_size=100, flush_interval=1)
+  >>> cache['foo'] = 'bar' # returns immediately
+  >>> cache.flush()        # blocks until 'foo' has been written
+
+  Attributes:
+    _dirty: maps a key to the value that has to be written.
+    _flushing: the batch that is being written by `flush` right now.
+    _flush_lock: serializes batches, so that an older value never
+      overwrites a newer one. Acquired before the cache lock.
+    _mutex: guards _flushing, acquired after the cache lock.
+  """
+
+  def __init__(self, store, policy=WRITE_BEHIND, flush_size=100,
+               flush_interval=1.0, **kwargs):
+    """
+    :param store: an object with a `write_many(items)` method.
+    :param policy: WRITE_THROUGH or WRITE_BEHIND.
+    :param flush_size: how many dirty items trigger a flush.
+    :param flush_interval: how often, in seconds, dirty items are flushed.
+    :param kwargs: the options of LruCache.
+    """
+    if policy not in (WRITE_THROUGH, WRITE_BEHIND):
+      raise ValueError(f'Unknown write policy: {policy}')
+    kwargs['concurrent'] = True
+    self._store = store
+    self._policy = policy
+    self._flush_size = flush_size
+    self._flush_interval = flush_interval
+    self._dirty = {}
+    self._flushing = {}
+    self._flush_lock = threading.Lock()
+    self._mutex = threading.Lock()
+    self._wakeup = threading.Condition()
+    self._flusher = None
+    super(WriteBackCache, self).__init__(**kwargs)
+    _write_back_caches[id(self)] = self
+
+  def _start_flusher(self):
+    if self._flusher is None:
+      self._flusher = _Flusher(self, self._wakeup, self._flush_interval)
+      self._flusher.start()
+
+  @lock
+  def add(self, key, value, expires=None, tags=None):
+    if self._policy == WRITE_THROUGH:
+      if key is not None and value is not None:
+        self._store.write_many({key: value})
+      return super(WriteBackCache, self).add(key, value, expires=expires, tags=tags)
+    super(WriteBackCache, self).add(key, value, expires=expires, tags=tags)
+    self._dirty[key] = value
+    self._start_flusher()
+    if len(self._dirty) >= self._flush_size:
+      with self._wakeup:
+        self._wakeup.notify()
+
+  def _write_out(self, key):
+    # writes a single dirty item right away, called with the lock held
+    with self._mutex:
+      if key in self._flushing:
+        # an older value of the key is being written by `flush` right now,
+        # writing this one first would let the older one win. It stays
+        # dirty and goes out with the next batch.
+        return
+      value = self._dirty.pop(key, _missing)
+      if value is _missing:
+        return
+      try:
+        self._store.write_many({key: value})
+      except Exception:
+        # it's still dirty, the next flush will retry
+        self._dirty.setdefault(key, value)
+
+  def _evict(self, node):
+    self._write_out(node.key)
+    super(WriteBackCache, self)._evict(node)
+
+  @lock
+  def _expire(self, node):
+    if self._mapping.get(node.key) is node:
+      self._write_out(node.key)
+    super(WriteBackCache, self)._expire(node)
+
+  def flush(self):
+    """Writes all dirty items to the store in a single batch and blocks
+    until the batch has been written. If the store fails, the items stay
+    dirty (unless they have been overwritten since) and the error is raised.
+    """
+    with self._flush_lock:
+      with self._lock:
+        batch, self._dirty = self._dirty, {}
+        with self._mutex:
+          self._flushing = batch
+      try:
+        if batch:
+          self._store.write_many(batch)
+      except Exception:
+        with self._lock:
+          for key, value in batch.items():
+            self._dirty.setdefault(key, value)
+        raise
+      finally:
+        with self._mutex:
+          self._flushing = {}
+
+  @property
+  def dirty(self):
+    """The number of items waiting to be written."""
+    return len(self._dirty)
+
+  def close(self):
+    """Stops the background flusher and flushes the dirty items."""
+    flusher, self._flusher = self._flusher, None
+    if flusher is not None:
+      flusher.stopped = True
+      with self._wakeup:
+        self._wakeup.notify()
+      flusher.join()
+    self.flush()
+    super(WriteBackCache, self).close()
+
+  def _after_fork(self):
+    super(WriteBackCache, self)._after_fork()
+    self._flush_lock = threading.Lock()
+    self._mutex = threading.Lock()
+    self._wakeup = threading.Condition()
+    self._flushing = {}
+    self._flusher = None
+    # the pending writes belong to the parent, which is going to write
+    # them, the child would only overwrite newer values with stale ones
+    self._dirty = {}
+
+  def __getstate__(self):
+    raise TypeError(f'cannot pickle {self.__class__.__name__}')
+
+
+# every live write-behind cache, flushed when the interpreter exits
+_write_back_caches = weakref.WeakValueDictionary()
+
+
+@atexit.register
+def _flush_all():
+  for cache in list(_write_back_caches.values()):
+    try:
+      cache.flush()
+    except Exception:
+      pass
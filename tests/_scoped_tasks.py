@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+"""Coroutines for test_scoped, in a module of their own because
+the async syntax needs Python 3.5+.
+"""
+import asyncio
+
+
+def run_tasks(cache, values):
+  """Runs a task per value, each of which sets 'a' to its value in its own
+  scope, lets the others run, and returns what it reads back.
+  """
+  @cache
+  async def handle(value):
+    cache['a'] = value
+    await asyncio.sleep(0.01)
+    return cache['a']
+
+  async def main():
+    return await asyncio.gather(*[handle(value) for value in values])
+
+  loop = asyncio.new_event_loop()
+  try:
+    return loop.run_until_complete(main())
+  finally:
+    loop.close()
@@ -0,0 +1,167 @@
+# -*- coding: future_fstrings -*-
+import os
+import random
+import shutil
+import sys
+import tempfile
+import unittest
+
+try:
+  import unittest.mock as mock
+except ImportError:
+  import mock
+
+from lru import LruCache
+from lru.analysis import (
+  Access, AccessTrace, MissRatioCurve,
+  Result, replay, main as analysis_main
+)
+
+
+def _workload(keys=2000, length=40000, seed=0):
+  # a skewed access pattern over a fixed set of keys
+  generator = random.Random(seed)
+  return [int(generator.paretovariate(1.0)) % keys for _ in range(length)]
+
+
+class MissRatioCurveTestCase(unittest.TestCase):
+  def test_rate(self):
+    with self.assertRaises(ValueError):
+      MissRatioCurve(rate=0)
+    with self.assertRaises(ValueError):
+      MissRatioCurve(rate=2)
+    with self.assertRaises(ValueError):
+      MissRatioCurve(max_keys=0)
+
+  def test_exact(self):
+    curve = MissRatioCurve(rate=1)
+    for key in ['a', 'b', 'c', 'a', 'b', 'c', 'c']:
+      curve.on_access(key, False)
+    self.assertEqual(curve.hit_ratio(0), 0)
+    self.assertAlmostEqual(curve.hit_ratio(1), 1 / 7)
+    self.assertAlmostEqual(curve.hit_ratio(3), 4 / 7)
+    self.assertEqual(curve.curve([1, 3]), [(1, curve.hit_ratio(1)), (3, curve.hit_ratio(3))])
+    self.assertEqual(MissRatioCurve().hit_ratio(10), 0)
+
+  def test_matches_cache(self):
+    workload = _workload()
+    for size in (10, 100, 1000):
+      curve = MissRatioCurve(rate=1)
+      cache = LruCache(maxsize=size)
+      cache.observe(curve)
+      hits = 0
+      for key in workload:
+        if cache.get(key) is None:
+          cache[key] = key + 1
+        else:
+          hits += 1
+      self.assertAlmostEqual(curve.hit_ratio(size), hits / len(workload))
+
+  def test_get_or_set(self):
+    curve = MissRatioCurve(rate=1)
+    cache = LruCache(maxsize=100)
+    cache.observe(curve)
+    for key in range(100):
+      cache.get_or_set(key, lambda: key)
+    # a miss is a single lookup, not a lookup and a reuse
+    self.assertEqual(curve.hit_ratio(10), 0)
+    self.assertEqual(curve._total, 100)
+    for key in range(100):
+      cache.get_or_set(key, lambda: key)
+    self.assertEqual(curve.hit_ratio(100), 0.5)
+
+  def test_sampled(self):
+    workload = _workload(keys=20000, length=200000)
+    exact = MissRatioCurve(rate=1, max_keys=20000)
+    sampled = MissRatioCurve(rate=0.1)
+    for key in workload:
+      exact.on_access(key, False)
+      sampled.on_access(key, False)
+    self.assertLess(len(sampled._last), len(exact._last) / 5)
+    for size in (100, 1000, 10000):
+      self.assertAlmostEqual(sampled.hit_ratio(size), exact.hit_ratio(size), delta=0.05)
+
+  def test_max_keys(self):
+    # most keys of the skewed workload are seen just a few times
+    generator = random.Random(0)
+    workload = [int(20000 * generator.random() ** 1.5) for _ in range(200000)]
+    exact = MissRatioCurve(rate=1, max_keys=20000)
+    bounded = MissRatioCurve(rate=1, max_keys=1000)
+    for key in workload:
+      exact.on_access(key, False)
+      bounded.on_access(key, False)
+    self.assertLessEqual(len(bounded._last), 1000)
+    self.assertEqual(len(bounded._times), len(bounded._last))
+    self.assertEqual(sum(len(keys) for keys in bounded._keys.values()),
+                     len(bounded._last))
+    self.assertLess(bounded._rate, 1)
+    for size in (100, 1000, 10000):
+      self.assertAlmostEqual(bounded.hit_ratio(size), exact.hit_ratio(size), delta=0.05)
+
+
+class AccessTraceTestCase(unittest.TestCase):
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+
+  def test_record(self):
+    trace = AccessTrace(capacity=3)
+    cache = LruCache(maxsize=10)
+    cache.observe(trace)
+    cache.get('a')
+    cache['a'] = 1
+    self.assertEqual([(op, key) for _, op, key in trace.entries()],
+                     [('r', hash('a')), ('w', hash('a'))])
+    cache.get_many(['a', 'b'])
+    self.assertEqual(len(trace), 3)
+    self.assertEqual([(op, key) for _, op, key in trace.entries()],
+                     [('w', hash('a')), ('r', hash('a')), ('r', hash('b'))])
+    cache.unobserve(trace)
+    cache['b'] = 2
+    self.assertEqual(len(trace), 3)
+    self.assertFalse(hasattr(cache, '_observers'))
+
+  def test_record_get_or_set(self):
+    trace = AccessTrace()
+    cache = LruCache(maxsize=10)
+    cache.observe(trace)
+    cache.get_or_set('a', lambda: 1)
+    cache.get_or_set('a', lambda: 2)
+    self.assertEqual([(op, key) for _, op, key in trace.entries()],
+                     [('r', hash('a')), ('r', hash('a'))])
+
+  def test_save_load(self):
+    trace = AccessTrace()
+    trace.on_access('a', True)
+    trace.on_add('b')
+    path = os.path.join(self.directory, 'trace.txt')
+    trace.save(path)
+    self.assertEqual(AccessTrace.load(path), trace.entries())
+
+  def test_replay(self):
+    entries = [Access(0, 'r', 1), Access(0, 'w', 1), Access(1, 'r', 2),
+               Access(2, 'r', 1), Access(10, 'r', 1), Access(11, 'r', 2)]
+    self.assertEqual(replay(entries, [1, 2], ttls=[None, 5]), [
+      Result(1, None, 1, 4), Result(2, None, 3, 2),
+      Result(1, 5, 0, 5), Result(2, 5, 1, 4)
+    ])
+
+  def test_main(self):
+    path = os.path.join(self.directory, 'trace.txt')
+    trace = AccessTrace()
+    for key in _workload(length=1000):
+      trace.on_access(key, False)
+    trace.save(path)
+    with mock.patch('sys.stdout') as stdout:
+      analysis_main([path, '--sizes', '10', '100', '--ttls', '0', '60'])
+    output = ''.join(call[0][0] for call in stdout.write.call_args_list)
+    self.assertEqual(len(output.strip().splitlines()), 5)
+
+
+def main():
+  unittest.main()
+
+if __name__ == '__main__':
+  main()
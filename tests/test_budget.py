@@ -0,0 +1,125 @@
+# -*- coding: future_fstrings -*-
+import os
+import pickle
+import sys
+import time
+import unittest
+import weakref
+
+try:
+  import unittest.mock as mock
+except ImportError:
+  import mock
+
+from lru import LruCache
+from lru.budget import MemoryBudget, _allocate, set_memory_budget
+from lru.compressed import CompressedCache
+
+
+class AllocateTestCase(unittest.TestCase):
+  def test_allocate(self):
+    self.assertEqual(_allocate(100, [(1, 100), (1, 100)]), [50, 50])
+    self.assertEqual(_allocate(100, [(3, 100), (1, 100)]), [75, 25])
+    # whatever a small cache doesn't need goes to the others
+    self.assertEqual(_allocate(100, [(1, 10), (1, 100), (2, 100)]), [10, 30, 60])
+    self.assertEqual(_allocate(1000, [(1, 10), (5, 20)]), [10, 20])
+    self.assertEqual(_allocate(1, [(1, 10), (1, 10)]), [1, 1])
+
+
+class ResizeTestCase(unittest.TestCase):
+  def test_resize(self):
+    cache = LruCache((i, i) for i in range(100))
+    with self.assertRaises(ValueError):
+      cache.resize(0)
+    with mock.patch.object(cache, '_shrink', wraps=cache._shrink) as shrink:
+      cache.resize(10, batch_size=20)
+    self.assertEqual(shrink.call_count, 5)
+    self.assertEqual(cache.keys(), list(range(99, 89, -1)))
+    cache[100] = 100
+    self.assertEqual(len(cache), 10)
+    cache.resize(20)
+    cache.update((i, i) for i in range(20))
+    self.assertEqual(len(cache), 20)
+    self.assertEqual(cache.info().maxsize, 20)
+
+  def test_info(self):
+    cache = LruCache([('a', 1)], maxsize=10)
+    cache.get('a')
+    cache.get('b')
+    cache.get_many(['a', 'c', 'd'])
+    self.assertEqual(cache.info(), (2, 3, 10, 1))
+
+  def test_info_get_or_set(self):
+    cache = LruCache(maxsize=10)
+    cache.get_or_set('a', lambda: 1)
+    self.assertEqual(cache.info(), (0, 1, 10, 1))
+    cache.get_or_set('a', lambda: 1)
+    self.assertEqual(cache.info(), (1, 1, 10, 1))
+
+
+class MemoryBudgetTestCase(unittest.TestCase):
+  def setUp(self):
+    # keep caches of other tests out of the budget
+    patcher = mock.patch('lru.cache._budgeted', weakref.WeakValueDictionary())
+    patcher.start()
+    self.addCleanup(patcher.stop)
+    self.addCleanup(set_memory_budget, None)
+
+  def test_limit(self):
+    with self.assertRaises(ValueError):
+      MemoryBudget(0)
+
+  def test_rebalance(self):
+    hot = LruCache(((i, i) for i in range(100)), maxsize=100)
+    cold = LruCache(((i, i) for i in range(100)), maxsize=100)
+    budget = MemoryBudget(limit=100)
+    for _ in range(3):
+      hot.get(1)
+    budget.rebalance()
+    self.assertEqual((len(hot), len(cold)), (80, 20))
+    self.assertEqual(hot.info().maxsize, 80)
+    # the cold cache got hot
+    for _ in range(6):
+      cold.get(99)
+    budget.rebalance()
+    self.assertEqual((hot._maxsize, cold._maxsize), (12, 87))
+    # nobody grows beyond the original maxsize
+    budget.limit = 1000
+    budget.rebalance()
+    self.assertEqual((hot._maxsize, cold._maxsize), (100, 100))
+    # caches that have been garbage collected are forgotten
+    del cold
+    budget.limit = 50
+    budget.rebalance()
+    self.assertEqual(hot._maxsize, 50)
+
+  def test_opt_out(self):
+    cache = LruCache(((i, i) for i in range(100)), maxsize=100)
+    private = LruCache(((i, i) for i in range(100)), maxsize=100, budget=False)
+    copy = pickle.loads(pickle.dumps(private))
+    # caches that other caches use internally are sized by their owners
+    compressed = CompressedCache(maxsize=100, hot_size=100)
+    MemoryBudget(limit=50).rebalance()
+    self.assertEqual((cache._maxsize, compressed._maxsize), (25, 25))
+    self.assertEqual((len(private), len(copy)), (100, 100))
+    self.assertEqual(compressed._decoded._maxsize, 100)
+
+  def test_set_memory_budget(self):
+    cache = LruCache((i, i) for i in range(100))
+    budget = set_memory_budget(10, interval=0.01)
+    self.assertEqual(len(cache), 10)
+    cache.resize(200)
+    deadline = time.time() + 2
+    while cache._maxsize != 10 and time.time() < deadline:
+      time.sleep(0.01)
+    self.assertEqual(cache._maxsize, 10)
+    self.assertIsNone(set_memory_budget(None))
+    self.assertEqual(cache._maxsize, 200)
+    self.assertIsNone(budget._enforcer)
+
+
+def main():
+  unittest.main()
+
+if __name__ == '__main__':
+  main()
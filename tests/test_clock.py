@@ -0,0 +1,82 @@
+# -*- coding: future_fstrings -*-
+import gc
+import threading
+import time
+import unittest
+
+from lru.clock import CoarseClock, MonotonicClock, VirtualClock
+from lru.compat import monotonic
+
+
+class ClockTestCase(unittest.TestCase):
+  def test_monotonic(self):
+    clock = MonotonicClock()
+    first = clock.now()
+    self.assertLessEqual(first, clock.now())
+
+  def test_coarse(self):
+    with self.assertRaises(ValueError):
+      CoarseClock(0)
+    clock = CoarseClock(resolution=0.005)
+    first = clock.now()
+    self.assertAlmostEqual(first, monotonic(), delta=0.5)
+    deadline = time.time() + 2
+    while clock.now() == first and time.time() < deadline:
+      time.sleep(0.01)
+    self.assertGreater(clock.now(), first)
+    ticker = clock._ticker
+    del clock
+    gc.collect()
+    ticker.join(2)
+    self.assertFalse(ticker.is_alive())
+
+  def test_virtual(self):
+    clock = VirtualClock(start=10)
+    self.assertEqual(clock.now(), 10)
+    clock.advance(5)
+    self.assertEqual(clock.now(), 15)
+    with self.assertRaises(ValueError):
+      clock.advance(-1)
+
+  def test_virtual_wait(self):
+    clock, condition = VirtualClock(), threading.Condition()
+    woken = threading.Event()
+
+    def wait():
+      with condition:
+        clock.wait(condition, 60)
+      woken.set()
+
+    waiter = threading.Thread(target=wait)
+    waiter.start()
+    # real time does not make the timeout pass
+    self.assertFalse(woken.wait(0.1))
+    clock.advance(60)
+    self.assertTrue(woken.wait(2))
+    waiter.join()
+
+  def test_virtual_register(self):
+    # a registered condition is notified even if the thread has read
+    # the time, but hasn't started waiting through the clock yet
+    clock, condition = VirtualClock(), threading.Condition()
+    clock.register(condition)
+    ready, woken = threading.Event(), []
+
+    def wait():
+      with condition:
+        ready.set()
+        woken.append(condition.wait(2))
+
+    waiter = threading.Thread(target=wait)
+    waiter.start()
+    ready.wait(2)
+    clock.advance(1)
+    waiter.join()
+    self.assertEqual(woken, [True])
+
+
+def main():
+  unittest.main()
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,251 @@
+# -*- coding: future_fstrings -*-
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import unittest
+
+try:
+  import unittest.mock as mock
+except ImportError:
+  import mock
+
+from lru.cluster import HashRing, PeerCache, _Server, _Pool, _PeerUnavailable
+
+
+class HashRingTestCase(unittest.TestCase):
+  def test_owner(self):
+    with self.assertRaises(ValueError):
+      HashRing([])
+    peers = ['a', 'b', 'c']
+    ring = HashRing(peers)
+    owners = [ring.owner(key) for key in range(300)]
+    self.assertEqual(owners, [HashRing(peers[::-1]).owner(key)
+                              for key in range(300)])
+    for peer in peers:
+      self.assertGreater(owners.count(peer), 50)
+    self.assertEqual(ring.owner('key'), ring.owner(u'key'))
+
+  def test_consistency(self):
+    before, after = HashRing(['a', 'b', 'c']), HashRing(['a', 'b', 'c', 'd'])
+    for key in range(300):
+      # a key either stays where it was or moves to the new peer
+      self.assertIn(after.owner(key), (before.owner(key), 'd'))
+
+
+class _ClusterTestCase(unittest.TestCase):
+  def setUp(self):
+    directory = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, directory)
+    self.addresses = [os.path.join(directory, f'{index}.sock')
+                      for index in range(3)]
+
+
+@unittest.skipUnless(hasattr(socket, 'AF_UNIX'), 'requires Unix sockets')
+class PeerCacheTestCase(_ClusterTestCase):
+  def setUp(self):
+    super(PeerCacheTestCase, self).setUp()
+    self.loads = []
+    self.mutex = threading.Lock()
+
+  def _load(self, key):
+    with self.mutex:
+      self.loads.append(key)
+    time.sleep(0.05)
+    if key == 'error':
+      raise KeyError(key)
+    return key * 2
+
+  def _peers(self, **kwargs):
+    peers = [PeerCache(address, self.addresses, self._load, **kwargs)
+             for address in self.addresses]
+    for peer in peers:
+      self.addCleanup(peer.close)
+    return peers
+
+  def test_get(self):
+    peers = self._peers()
+    for key in range(20):
+      for peer in peers:
+        self.assertEqual(peer.get(key), key * 2)
+    self.assertEqual(sorted(self.loads), list(range(20)))
+    for key in range(20):
+      owner = peers[self.addresses.index(peers[0].owner(key))]
+      self.assertIn(key, owner._cache._mapping)
+      for peer in peers:
+        if peer is not owner:
+          self.assertNotIn(key, peer._cache._mapping)
+
+  def test_coalescing(self):
+    peers = self._peers()
+    threads = [threading.Thread(target=peer.get, args=('key',))
+               for peer in peers for _ in range(5)]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    self.assertEqual(self.loads, ['key'])
+
+  def test_errors(self):
+    peers = self._peers(hot_size=0)
+    for peer in peers:
+      with self.assertRaises(KeyError):
+        peer.get('error')
+
+  def test_owner_down(self):
+    peers = self._peers(timeout=1)
+    key = next(key for key in range(100)
+               if peers[0].owner(key) == self.addresses[1])
+    peers[1].close()
+    self.assertEqual(peers[0].get(key), key * 2)
+    self.assertEqual(peers[2].get(key), key * 2)
+    self.assertEqual(self.loads, [key, key])
+    # the value loaded in place of the owner is not replicated
+    self.assertNotIn(key, peers[0]._hot._mapping)
+    self.assertEqual(peers[0].get(key), key * 2)
+    self.assertEqual(self.loads, [key, key, key])
+
+  def test_pipelining(self):
+    slow = threading.Event()
+    def handle(key):
+      if key == 'slow':
+        slow.wait(5)
+      return key
+    server = _Server(self.addresses[0], handle)
+    self.addCleanup(server.close)
+    pool = _Pool(self.addresses[0], 1, 5)
+    self.addCleanup(pool.close)
+    results = []
+    thread = threading.Thread(target=lambda: results.append(pool.request('slow')))
+    thread.start()
+    # the second request shares the connection and overtakes the first one
+    self.assertEqual(pool.request('fast'), 'fast')
+    slow.set()
+    thread.join()
+    self.assertEqual(results, ['slow'])
+    self.assertEqual(len(pool._connections), 1)
+    server.close()
+    with self.assertRaises(_PeerUnavailable):
+      pool.request('gone')
+
+  @unittest.skipUnless(hasattr(threading, 'Barrier'), 'requires threading.Barrier')
+  def test_connect_concurrently(self):
+    # both threads have to be connecting at the same time to get through
+    barrier = threading.Barrier(2, timeout=2)
+
+    class Connection(object):
+      closed = False
+
+      def __init__(self, address, timeout):
+        barrier.wait()
+
+      def request(self, key, timeout):
+        return key
+
+      def close(self):
+        self.closed = True
+
+    pool = _Pool(self.addresses[0], 1, 5)
+    results = []
+    with mock.patch('lru.cluster._Connection', Connection):
+      threads = [threading.Thread(target=lambda key=key: results.append(pool.request(key)))
+                 for key in range(2)]
+      for thread in threads:
+        thread.start()
+      for thread in threads:
+        thread.join()
+    self.assertEqual(sorted(results), [0, 1])
+    # the second connection was not needed
+    self.assertEqual(len(pool._connections), 1)
+    # a connection made while the pool is being closed is not kept
+    barrier = threading.Barrier(1)
+    pool.close()
+    with mock.patch('lru.cluster._Connection', Connection):
+      with self.assertRaises(_PeerUnavailable):
+        pool.request('closed')
+    self.assertEqual(pool._connections, [])
+
+  def test_workers(self):
+    mutex, running, peak = threading.Lock(), [0], [0]
+    release = threading.Event()
+    def handle(key):
+      with mutex:
+        running[0] += 1
+        peak[0] = max(peak[0], running[0])
+      release.wait(5)
+      with mutex:
+        running[0] -= 1
+      return key
+    server = _Server(self.addresses[0], handle, workers=2)
+    self.addCleanup(server.close)
+    pool = _Pool(self.addresses[0], 1, 5)
+    self.addCleanup(pool.close)
+    results = []
+    threads = [threading.Thread(target=lambda key=key: results.append(pool.request(key)))
+               for key in range(6)]
+    for thread in threads:
+      thread.start()
+    deadline = time.time() + 2
+    while peak[0] < 2 and time.time() < deadline:
+      time.sleep(0.01)
+    # give the rest of the burst the time to arrive, it has to queue
+    time.sleep(0.1)
+    release.set()
+    for thread in threads:
+      thread.join()
+    self.assertEqual(peak[0], 2)
+    self.assertEqual(sorted(results), list(range(6)))
+
+
+@unittest.skipUnless(hasattr(socket, 'AF_UNIX') and hasattr(os, 'fork'),
+                     'requires Unix sockets and fork')
+class ClusterProcessesTestCase(_ClusterTestCase):
+  def test_processes(self):
+    def load(key):
+      return os.getpid(), key
+
+    ready_r, ready_w = os.pipe()
+    stop_r, stop_w = os.pipe()
+    pids = []
+    for address in self.addresses[1:]:
+      pid = os.fork()
+      if not pid:
+        code = 1
+        try:
+          os.close(stop_w)
+          peer = PeerCache(address, self.addresses, load)
+          os.write(ready_w, b'1')
+          # serves the other peers until the parent goes away
+          os.read(stop_r, 1)
+          peer.close()
+          code = 0
+        finally:
+          os._exit(code)
+      pids.append(pid)
+    os.close(stop_r)
+    try:
+      peer = PeerCache(self.addresses[0], self.addresses, load)
+      self.addCleanup(peer.close)
+      for _ in pids:
+        os.read(ready_r, 1)
+      owners = dict(zip(self.addresses, [os.getpid()] + pids))
+      for key in range(30):
+        pid, loaded = peer.get(key)
+        self.assertEqual(loaded, key)
+        self.assertEqual(pid, owners[peer.owner(key)])
+      self.assertEqual(set(peer.get(key)[0] for key in range(30)),
+                       set(owners.values()))
+    finally:
+      os.close(stop_w)
+      for pid in pids:
+        _, status = os.waitpid(pid, 0)
+        self.assertEqual(os.WEXITSTATUS(status), 0)
+
+
+def main():
+  unittest.main()
+
+if __name__ == '__main__':
+  main()
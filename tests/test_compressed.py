@@ -0,0 +1,106 @@
+# -*- coding: future_fstrings -*-
+import bz2
+import pickle
+import unittest
+
+try:
+  import unittest.mock as mock
+except ImportError:
+  import mock
+
+from lru.compressed import CompressedCache, _Compressed
+
+
+_TEXT = 'All work and no play makes Jack a dull boy. ' * 100
+
+
+class CompressedCacheTestCase(unittest.TestCase):
+  def test_compression(self):
+    cache = CompressedCache(threshold=100)
+    cache['text'] = _TEXT
+    cache['bytes'] = _TEXT.encode('utf-8')
+    cache['small'] = 'small'
+    cache['number'] = 42
+    self.assertIsInstance(cache._mapping['text'].value, _Compressed)
+    self.assertIsInstance(cache._mapping['bytes'].value, _Compressed)
+    self.assertEqual(cache._mapping['small'].value, 'small')
+    self.assertEqual(cache['text'], _TEXT)
+    self.assertEqual(cache['bytes'], _TEXT.encode('utf-8'))
+    self.assertEqual(cache.get_many(['small', 'text', 'missing'], 0),
+                     ['small', _TEXT, 0])
+    self.assertEqual(dict(cache.items())['text'], _TEXT)
+    self.assertIn(42, cache.values())
+
+  def test_incompressible(self):
+    cache = CompressedCache(threshold=10)
+    value = bytes(bytearray(range(256)))
+    cache['a'] = value
+    self.assertIs(cache._mapping['a'].value, value)
+
+  def test_codec(self):
+    cache = CompressedCache(threshold=100, codec='bz2')
+    cache['a'] = _TEXT
+    self.assertEqual(bz2.decompress(cache._mapping['a'].value.data),
+                     _TEXT.encode('utf-8'))
+    codec = mock.Mock(wraps=bz2)
+    cache = CompressedCache(threshold=100, codec=codec, hot_size=0)
+    cache['a'] = _TEXT
+    self.assertEqual(cache['a'], _TEXT)
+    self.assertEqual(cache['a'], _TEXT)
+    self.assertEqual(codec.decompress.call_count, 2)
+
+  def test_hot_values(self):
+    codec = mock.Mock(wraps=bz2)
+    cache = CompressedCache(threshold=100, codec=codec, hot_size=1)
+    cache.update([('a', _TEXT), ('b', _TEXT * 2)])
+    for _ in range(3):
+      self.assertEqual(cache['a'], _TEXT)
+    self.assertEqual(codec.decompress.call_count, 1)
+    cache['b']
+    cache['a']
+    self.assertEqual(codec.decompress.call_count, 3)
+    # a new value is never served from the side cache
+    cache['a'] = _TEXT * 3
+    self.assertEqual(cache['a'], _TEXT * 3)
+    del cache['a']
+    self.assertNotIn('a', cache._decoded)
+
+  def test_maxbytes(self):
+    with self.assertRaises(ValueError):
+      CompressedCache(maxbytes=0)
+    cache = CompressedCache(maxsize=100, maxbytes=10, threshold=100)
+    cache.update([('a', 'aaaa'), ('b', 'bbbb')])
+    self.assertEqual(cache.nbytes, 8)
+    cache['c'] = 'cccc'
+    self.assertEqual(cache.keys(), ['c', 'b'])
+    self.assertEqual(cache.nbytes, 8)
+    cache['b'] = 'bbbbbb'
+    self.assertEqual(cache.keys(), ['b', 'c'])
+    self.assertEqual(cache.nbytes, 10)
+    cache['d'] = 'dd'
+    self.assertEqual(cache.keys(), ['d', 'b'])
+    cache.clear()
+    self.assertEqual(cache.nbytes, 0)
+    # compressed values are counted by their compressed size
+    cache = CompressedCache(maxbytes=len(_TEXT), threshold=100)
+    cache.update((key, _TEXT) for key in range(5))
+    self.assertEqual(len(cache), 5)
+    self.assertLess(cache.nbytes, len(_TEXT))
+
+  def test_pickle(self):
+    cache = CompressedCache(threshold=100, codec='bz2', maxbytes=10000,
+                            hot_size=4, expires=60)
+    cache.update([('a', _TEXT), ('b', 'b')])
+    copy = pickle.loads(pickle.dumps(cache))
+    self.assertEqual(copy.items(), cache.items())
+    self.assertEqual(copy.nbytes, cache.nbytes)
+    self.assertEqual(copy._codec, bz2)
+    self.assertEqual(copy._hot_size, 4)
+    self.assertEqual(copy._expires, 60)
+
+
+def main():
+  unittest.main()
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,127 @@
+# -*- coding: future_fstrings -*-
+import pickle
+import time
+import unittest
+
+from lru import lru_cache, batch_cache
+from lru.cost import CostAwareCache
+
+
+class CostAwareCacheTestCase(unittest.TestCase):
+  def test_lru_without_costs(self):
+    cache = CostAwareCache(((key, key) for key in 'abc'), maxsize=3)
+    cache['a']
+    cache['d'] = 'd'
+    self.assertEqual(sorted(cache.keys()), ['a', 'c', 'd'])
+    cache['e'] = 'e'
+    self.assertEqual(sorted(cache.keys()), ['a', 'd', 'e'])
+
+  def test_expensive_items_stay(self):
+    cache = CostAwareCache(maxsize=3)
+    cache.add('slow', 1, cost=2.0)
+    for key in range(10):
+      cache.add(key, key, cost=0.001)
+    self.assertIn('slow', cache)
+    self.assertEqual(len(cache), 3)
+    self.assertEqual(cache.cost('slow'), 2.0)
+    self.assertIsNone(cache.cost('missing'))
+
+  def test_aging(self):
+    cache = CostAwareCache(maxsize=2)
+    cache.add('old', 1, cost=1.0)
+    cache.add('a', 1, cost=0.6)
+    # every eviction inflates the priority of the new items,
+    # until an expensive item that is never hit is overtaken
+    cache.add('b', 1, cost=0.6)
+    self.assertEqual(sorted(cache.keys()), ['b', 'old'])
+    cache.add('c', 1, cost=0.6)
+    self.assertEqual(sorted(cache.keys()), ['b', 'c'])
+
+  def test_size(self):
+    cache = CostAwareCache(maxsize=2, sizeof=len)
+    cache.add('big', 'x' * 100, cost=1.0)
+    cache.add('small', 'x', cost=0.1)
+    cache.add('new', 'x', cost=0.1)
+    # 1.0 / 100 is less than 0.1 / 1
+    self.assertEqual(sorted(cache.keys()), ['new', 'small'])
+
+  def test_saved(self):
+    cache = CostAwareCache(maxsize=10)
+    cache.add('a', 1, cost=0.5)
+    cache['a']
+    cache.get_many(['a', 'b'])
+    self.assertEqual(cache.saved, 1.0)
+
+  def test_get_or_set(self):
+    cache = CostAwareCache(maxsize=10)
+    cache.get_or_set('slow', lambda: time.sleep(0.05) or 1)
+    cache.get_or_set('fast', lambda: 1)
+    self.assertGreaterEqual(cache.cost('slow'), 0.04)
+    self.assertLess(cache.cost('fast'), cache.cost('slow'))
+    self.assertEqual(cache._measured, {})
+    with self.assertRaises(ValueError):
+      cache.get_or_set('none', lambda: None)
+    self.assertEqual(cache._measured, {})
+
+  def test_heap_compaction(self):
+    cache = CostAwareCache(maxsize=10)
+    cache.add('a', 1)
+    for _ in range(1000):
+      cache['a']
+    self.assertLess(len(cache._heap), 100)
+    del cache['a']
+    self.assertEqual(cache._priorities, {})
+
+  def test_resize(self):
+    cache = CostAwareCache(maxsize=10)
+    cache.add('slow', 1, cost=1.0)
+    cache.update((key, key) for key in range(9))
+    cache.resize(2)
+    self.assertIn('slow', cache)
+    self.assertEqual(len(cache), 2)
+
+  def test_pickle(self):
+    cache = CostAwareCache(maxsize=10, sizeof=len)
+    cache.add('a', 'aaa', cost=1.0)
+    copy = pickle.loads(pickle.dumps(cache))
+    self.assertEqual(copy.items(), [('a', 'aaa')])
+    self.assertIs(copy._sizeof, len)
+
+
+class CostAwareDecoratorsTestCase(unittest.TestCase):
+  def test_lru_cache(self):
+    calls = []
+
+    @lru_cache(maxsize=2, cost_aware=True)
+    def function(x):
+      calls.append(x)
+      if x == 'slow':
+        time.sleep(0.05)
+      return x
+
+    for x in ['slow', 1, 2, 3, 'slow']:
+      function(x)
+    self.assertEqual(calls, ['slow', 1, 2, 3])
+
+  def test_batch_cache(self):
+    calls = []
+
+    @batch_cache(maxsize=2, cost_aware=True)
+    def function(xs):
+      calls.append(list(xs))
+      if 'slow' in xs:
+        time.sleep(0.05)
+      return xs
+
+    function(['slow'])
+    function([1])
+    function([2])
+    self.assertEqual(function(['slow', 2]), ['slow', 2])
+    self.assertEqual(calls, [['slow'], [1], [2]])
+
+
+def main():
+  unittest.main()
+
+if __name__ == '__main__':
+  main()
@@ -1,13 +1,24 @@
 # -*- coding: future_fstrings -*-
 import os
 import sys
+import threading
 import unittest
 try:
   import unittest.mock as mock
 except ImportError:
   import mock
 
-from lru import lru_cache, lazy_cache
+from lru import (
+  lru_cache, lazy_cache, process_cache, batch_cache, stream_cache
+)
+from lru.clock import VirtualClock
+from lru.compat import futures
+from lru.decorators import _get_key, _buffer_key, _digests
+
+try:
+  import numpy
+except ImportError:
+  numpy = None
 
 _mock_func = mock.Mock()
 # Python 2 raises an exception if not provided
@@ -22,6 +33,56 @@ def _reset(*mocks):
     mock.reset_mock()
 
 
+@process_cache(maxsize=10, max_workers=2)
+def _pid_power(x, power=2):
+  # the pid tells us that the function has been called in another process
+  return os.getpid(), x ** power
+
+
+_release = threading.Event()
+# released whenever a caller starts waiting for the result of a call
+_parked = threading.Semaphore(0)
+_pool = futures.ThreadPoolExecutor(4)
+
+def _submit_and_count(*args, **kwargs):
+  future = _pool.submit(*args, **kwargs)
+  result = future.result
+  def _result(*args, **kwargs):
+    _parked.release()
+    return result(*args, **kwargs)
+  future.result = _result
+  return future
+
+_executor = mock.Mock(wraps=_pool)
+_executor.submit.side_effect = _submit_and_count
+
+@process_cache(maxsize=10, executor=_executor)
+def _wait_for_release(x):
+  _release.wait(5)
+  return x
+
+
+class _InlineExecutor(object):
+  """Runs the function right away, so the future is done
+  before anybody can add a callback to it.
+  """
+
+  def submit(self, function, *args, **kwargs):
+    future = futures.Future()
+    try:
+      future.set_result(function(*args, **kwargs))
+    except Exception as error:
+      future.set_exception(error)
+    return future
+
+
+_nothing_calls = []
+
+@process_cache(maxsize=10, executor=_InlineExecutor())
+def _nothing(x):
+  _nothing_calls.append(x)
+
+
 class DummyEntry(object):
   def __init__(self, value):
     self.value = value
@@ -36,8 +97,7 @@ class CacheDecoratorsTestCase(unittest.TestCase):
     _mock_func.reset_mock()
     # set up mocks
     cache = LruCacheMock()
-    cache.__contains__.return_value = True
-    cache.__getitem__.return_value = value
+    cache.get_or_set.return_value = value
     get_key_mock.return_value = key
     _mock_func.return_value = value
     function = _prepare(lru_cache)
@@ -46,21 +106,19 @@ class CacheDecoratorsTestCase(unittest.TestCase):
     # key is in cache, return it
     self.assertEqual(function(key), value)
 
-    cache.__contains__.assert_called_once_with(key)
-    cache.__getitem__.assert_called_once_with(key)
+    cache.get_or_set.assert_called_once_with(key, mock.ANY)
     get_key_mock.assert_called_once_with(_mock_func, (key,), {})
     _mock_func.assert_not_called()
 
     # 2 case
     # key is not in cache
-    # call the function, cache the result, return it
+    # call the function through the loader, return the result
     _reset(get_key_mock, cache)
-    cache.__contains__.return_value = False
+    cache.get_or_set.side_effect = lambda key, loader: loader()
 
     self.assertEqual(function(key), value)
 
-    cache.__contains__.assert_called_once_with(key)
-    cache.__setitem__.assert_called_once_with(key, value)
+    cache.get_or_set.assert_called_once_with(key, mock.ANY)
     get_key_mock.assert_called_with(_mock_func, (key,), {})
     _mock_func.assert_called_with(key)
 
@@ -139,6 +197,230 @@ class CacheDecoratorsTestCase(unittest.TestCase):
     _mock_func.assert_called_once_with(key)
     get_key_mock.assert_called_with(_mock_func, (key,), {})
 
+  def test_clock(self):
+    clock, calls = VirtualClock(), []
+
+    @lru_cache(maxsize=10, expires=60, clock=clock)
+    def function(x):
+      calls.append(x)
+      return x
+
+    function(1)
+    clock.advance(59)
+    function(1)
+    self.assertEqual(calls, [1])
+    clock.advance(1)
+    function(1)
+    self.assertEqual(calls, [1, 1])
+
+
+class ProcessCacheTestCase(unittest.TestCase):
+  def tearDown(self):
+    _pid_power.shutdown()
+
+  def test_process_cache(self):
+    pid, value = _pid_power(3)
+    self.assertEqual(value, 9)
+    self.assertNotEqual(pid, os.getpid())
+    self.assertEqual(_pid_power(3), (pid, value))
+    self.assertEqual(_pid_power(3, power=3)[1], 27)
+
+  def test_map(self):
+    self.assertEqual([value for _, value in _pid_power.map([4, 5, 4])], [16, 25, 16])
+    self.assertEqual([value for _, value in _pid_power.map([5, 6], [3, 1])], [125, 6])
+
+  def test_deduplication(self):
+    threads = [threading.Thread(target=_wait_for_release, args=(1,))
+               for _ in range(3)]
+    for thread in threads:
+      thread.start()
+    results = []
+    mapper = threading.Thread(target=lambda: results.extend(
+      _wait_for_release.map([1, 2, 1])))
+    mapper.start()
+    # nothing can be cached before the release, so every thread waits
+    # for a call, map after it has submitted all of its misses
+    for _ in range(4):
+      self.assertTrue(_parked.acquire(timeout=5))
+    _release.set()
+    for thread in threads + [mapper]:
+      thread.join(5)
+    self.assertEqual(results, [1, 2, 1])
+    self.assertEqual([call[0][-2] for call in _executor.submit.call_args_list],
+                     [(1,), (2,)])
+
+  def test_none(self):
+    # None can't be cached, so every call raises, as with lru_cache
+    with self.assertRaises(ValueError):
+      _nothing(1)
+    # the finished call must not be handed out again
+    with self.assertRaises(ValueError):
+      _nothing(1)
+    self.assertEqual(_nothing_calls, [1, 1])
+
+
+class KeyTestCase(unittest.TestCase):
+  def test_get_key(self):
+    self.assertEqual(_get_key(_mock_func, (1, 'a'), {'b': 2}),
+                     _get_key(_mock_func, (1, 'a'), {'b': 2}))
+    self.assertNotEqual(_get_key(_mock_func, (1, 'a'), {}),
+                        _get_key(_mock_func, (1, 'b'), {}))
+
+  def test_bytes(self):
+    data = b'x' * 100000
+    changed = data[:50000] + b'y' + data[50001:]
+    self.assertEqual(_get_key(_mock_func, (data,), {}),
+                     _get_key(_mock_func, (data[:],), {}))
+    self.assertNotEqual(_get_key(_mock_func, (data,), {}),
+                        _get_key(_mock_func, (changed,), {}))
+    self.assertNotEqual(_get_key(_mock_func, (), {'data': data}),
+                        _get_key(_mock_func, (), {'data': changed}))
+    self.assertEqual(_buffer_key(memoryview(data)).digest, _buffer_key(data).digest)
+
+  @unittest.skipIf(numpy is None, 'requires numpy')
+  def test_ndarray(self):
+    array = numpy.zeros(100000)
+    changed = array.copy()
+    changed[50000] = 1
+    # the repr of both arrays is the same
+    self.assertEqual(str(array), str(changed))
+    self.assertNotEqual(_get_key(_mock_func, (array,), {}),
+                        _get_key(_mock_func, (changed,), {}))
+    self.assertEqual(_get_key(_mock_func, (array,), {}),
+                     _get_key(_mock_func, (array.copy(),), {}))
+    # same bytes, different metadata
+    self.assertNotEqual(_buffer_key(array), _buffer_key(array.view('int64')))
+    self.assertNotEqual(_buffer_key(array), _buffer_key(array.reshape(2, -1)))
+    # non-contiguous views are hashed by their contents
+    self.assertEqual(_buffer_key(changed[::2]).digest,
+                     _buffer_key(changed[::2].copy()).digest)
+    objects = numpy.array([None, 1], dtype=object)
+    self.assertIsNone(_buffer_key(objects))
+    self.assertEqual(_get_key(_mock_func, (objects,), {}),
+                     _get_key(_mock_func, (objects,), {}))
+
+  @unittest.skipIf(numpy is None, 'requires numpy')
+  def test_digest_cache(self):
+    writeable = numpy.zeros(100000)
+    _buffer_key(writeable)
+    self.assertNotIn(id(writeable), _digests)
+
+    frozen = numpy.frombuffer(b'\0' * 800000)
+    key = _buffer_key(frozen)
+    self.assertIn(id(frozen), _digests)
+    with mock.patch('lru.decorators._hash_buffer') as hash_mock:
+      self.assertEqual(_buffer_key(frozen), key)
+      hash_mock.assert_not_called()
+    ident = id(frozen)
+    del frozen
+    self.assertNotIn(ident, _digests)
+
+
+class BatchCacheTestCase(unittest.TestCase):
+  def _prepare(self, **kwargs):
+    function = mock.Mock(side_effect=lambda xs, factor=2: [x * factor for x in xs])
+    function.__name__ = 'MockFunc'
+    return function, batch_cache(**kwargs)(function)
+
+  def test_batch_cache(self):
+    function, wrapper = self._prepare()
+    self.assertEqual(wrapper([1, 2, 3]), [2, 4, 6])
+    function.assert_called_once_with([1, 2, 3])
+
+    function.reset_mock()
+    self.assertEqual(wrapper([3, 4, 1]), [6, 8, 2])
+    function.assert_called_once_with([4])
+
+    function.reset_mock()
+    self.assertEqual(wrapper((4, 2)), (8, 4))
+    function.assert_not_called()
+
+    # other arguments are a part of every element's key
+    self.assertEqual(wrapper([1], factor=3), [3])
+    function.assert_called_once_with([1], factor=3)
+
+  def test_wrong_length(self):
+    function, wrapper = self._prepare()
+    function.side_effect = lambda xs: []
+    with self.assertRaises(ValueError):
+      wrapper([1])
+
+  @unittest.skipIf(numpy is None, 'requires numpy')
+  def test_ndarray(self):
+    function, wrapper = self._prepare()
+    function.side_effect = lambda xs: xs ** 2
+    result = wrapper(numpy.array([1, 2, 3]))
+    self.assertEqual(result.tolist(), [1, 4, 9])
+
+    function.reset_mock()
+    result = wrapper(numpy.array([3, 4, 1]))
+    self.assertIsInstance(result, numpy.ndarray)
+    self.assertEqual(result.tolist(), [9, 16, 1])
+    self.assertEqual(function.call_args[0][0].tolist(), [4])
+
+    # rows of a matrix are elements too
+    function.side_effect = lambda xs: xs.sum(axis=1)
+    matrix = numpy.arange(6).reshape(3, 2)
+    self.assertEqual(wrapper(matrix).tolist(), [1, 5, 9])
+    self.assertEqual(wrapper(matrix[::-1]).tolist(), [9, 5, 1])
+
+
+class StreamCacheTestCase(unittest.TestCase):
+  def setUp(self):
+    self.pulled = []
+
+    @stream_cache(maxsize=10)
+    def numbers(n, fail_at=None):
+      for number in range(n):
+        self.pulled.append(number)
+        if number == fail_at:
+          raise ValueError(number)
+        yield number
+    self.numbers = numbers
+
+  def test_replay(self):
+    self.assertEqual(list(self.numbers(5)), [0, 1, 2, 3, 4])
+    self.assertEqual(list(self.numbers(5)), [0, 1, 2, 3, 4])
+    self.assertEqual(self.pulled, [0, 1, 2, 3, 4])
+    self.assertEqual(list(self.numbers(2)), [0, 1])
+    self.assertEqual(self.pulled, [0, 1, 2, 3, 4, 0, 1])
+
+  def test_partial(self):
+    first = self.numbers(5)
+    self.assertEqual([next(first), next(first)], [0, 1])
+    self.assertEqual(self.pulled, [0, 1])
+    # replays the prefix, then continues the same generator
+    second = self.numbers(5)
+    self.assertEqual(list(second), [0, 1, 2, 3, 4])
+    self.assertEqual(list(first), [2, 3, 4])
+    self.assertEqual(self.pulled, [0, 1, 2, 3, 4])
+
+  def test_concurrent(self):
+    results = []
+    def consume():
+      results.append(list(self.numbers(100)))
+    threads = [threading.Thread(target=consume) for _ in range(4)]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    self.assertEqual(results, [list(range(100))] * 4)
+    self.assertEqual(self.pulled, list(range(100)))
+
+  def test_error(self):
+    first, second = self.numbers(20, 13), self.numbers(20, 13)
+    with self.assertRaises(ValueError):
+      list(first)
+    # every consumer sees the same items and the same error
+    self.assertEqual([next(second) for _ in range(13)], list(range(13)))
+    with self.assertRaises(ValueError):
+      next(second)
+    self.assertEqual(self.pulled, list(range(14)))
+    # the failed recording is not cached
+    with self.assertRaises(ValueError):
+      list(self.numbers(20, 13))
+    self.assertEqual(len(self.pulled), 28)
+
 
 def main():
   unittest.main()
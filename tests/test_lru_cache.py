@@ -1,6 +1,10 @@
 # -*- coding: future_fstrings -*-
+import gc
 import os
+import pickle
 import sys
+import threading
+import time
 import unittest
 
 try:
@@ -9,9 +13,10 @@ except ImportError:
   import mock
 
 from lru import LruCache
+from lru.clock import VirtualClock
 from lru.cache import (
   _create_node, _ExpNode, _Node,
-  _CleanManager
+  _CleanManager, _sentinel
 )
 
 
@@ -55,6 +60,13 @@ class LruCacheTestCase(unittest.TestCase):
     cache['c'] = 5
     self.assertEqual(cache.items(), [('c', 5), ('b', 4), ('a', 3)])
 
+  def test_maxsize(self):
+    cache = LruCache(maxsize=2)
+    cache.update([('a', 1), ('b', 2), ('c', 3)])
+    self.assertEqual(cache.items(), [('c', 3), ('b', 2)])
+    cache['b'] = 4
+    self.assertEqual(cache.items(), [('b', 4), ('c', 3)])
+
   def test_contains(self):
     self.assertFalse('a' in LruCache())
     self.assertFalse('a' in LruCache([('b', 2), ('c', 3), ('d', 4)]))
@@ -146,9 +158,152 @@ class LruCacheTestCase(unittest.TestCase):
     self.assertFalse(LruCache(pairs) == LruCache(pairs[1:]))
     self.assertFalse(LruCache(pairs) == LruCache(pairs[::-1]))
 
+  def test_options(self):
+    cache = LruCache(maxsize=10, expires=10, concurrent=True)
+    self.assertEqual(cache.items(), [])
+    self.assertEqual(LruCache(a=1, expires=10).items(), [('a', 1)])
+
+  def test_get(self):
+    cache = LruCache([('a', 1), ('b', 2)])
+    self.assertEqual(cache.get('a'), 1)
+    self.assertEqual(cache.keys(), ['a', 'b'])
+    self.assertIsNone(cache.get('c'))
+    self.assertEqual(cache.get('c', 3), 3)
+
+  def test_get_many(self):
+    cache = LruCache([('a', 1), ('b', 2), ('c', 3)])
+    self.assertEqual(cache.get_many(['b', 'd', 'a']), [2, None, 1])
+    self.assertEqual(cache.get_many(['d'], 0), [0])
+    self.assertEqual(cache.keys(), ['a', 'b', 'c'])
+
+  def test_get_or_set(self):
+    cache = LruCache()
+    loader = mock.Mock(return_value=1)
+    self.assertEqual(cache.get_or_set('a', loader), 1)
+    self.assertEqual(cache.get_or_set('a', loader), 1)
+    loader.assert_called_once_with()
+    self.assertEqual(cache.items(), [('a', 1)])
+
+  def test_get_or_set_concurrent(self):
+    cache = LruCache(concurrent=True)
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def slow_loader():
+      calls.append('a')
+      started.set()
+      release.wait(5)
+      return 1
+
+    threads = [threading.Thread(target=cache.get_or_set, args=('a', slow_loader))
+               for _ in range(3)]
+    for thread in threads:
+      thread.start()
+    started.wait(5)
+    # an unrelated key is not blocked by the pending loader
+    self.assertEqual(cache.get_or_set('b', lambda: 2), 2)
+    release.set()
+    for thread in threads:
+      thread.join(5)
+    self.assertEqual(calls, ['a'])
+    self.assertEqual(cache['a'], 1)
+    self.assertFalse(cache._key_locks._locks)
+
+  def test_compute(self):
+    cache = LruCache([('a', 1)])
+    self.assertEqual(cache.compute('a', lambda key, value: value + 1), 2)
+    self.assertEqual(cache['a'], 2)
+    self.assertEqual(cache.compute('b', lambda key, value: (value or 0) + 1), 1)
+    self.assertEqual(cache['b'], 1)
+    self.assertIsNone(cache.compute('a', lambda key, value: None))
+    self.assertNotIn('a', cache)
+    self.assertIsNone(cache.compute('c', lambda key, value: None))
+
+  def test_tags(self):
+    cache = LruCache(maxsize=3)
+    cache.add('a', 1, tags=['user:1', 'tenant:1'])
+    cache.add('b', 2, tags=['user:2', 'tenant:1'])
+    cache.add('c', 3)
+    self.assertEqual(sorted(cache.tagged('tenant:1')), ['a', 'b'])
+    self.assertEqual(cache.invalidate_tag('user:1'), 1)
+    self.assertEqual(cache.keys(), ['c', 'b'])
+    self.assertEqual(cache.tagged('tenant:1'), ['b'])
+    self.assertEqual(cache.invalidate_tag('missing'), 0)
+    self.assertEqual(cache.invalidate_tag('tenant:1'), 1)
+    self.assertEqual(cache.keys(), ['c'])
+    self.assertEqual(cache._tags, {})
+    self.assertEqual(cache._key_tags, {})
+
+  def test_tags_maintenance(self):
+    cache = LruCache(maxsize=2)
+    cache.add('a', 1, tags=['x'])
+    # replacing the item replaces its tags
+    cache.add('a', 2, tags=['y'])
+    self.assertEqual(cache.tagged('x'), [])
+    self.assertEqual(cache.tagged('y'), ['a'])
+    cache['a'] = 3
+    self.assertEqual(cache._tags, {})
+    # eviction
+    cache.add('b', 1, tags=['x'])
+    cache.add('c', 1)
+    cache.add('d', 1)
+    self.assertEqual(cache._tags, {})
+    self.assertEqual(cache._key_tags, {})
+    cache.get_or_set('e', lambda: 1, tags=['z'])
+    del cache['e']
+    self.assertEqual(cache._key_tags, {})
+
+  def test_tags_expiration(self):
+    cache = LruCache(maxsize=10)
+    cache.add('a', 1, expires=0.05, tags=['x'])
+    cache.add('b', 2, tags=['x'])
+    deadline = time.time() + 2
+    while 'a' in cache and time.time() < deadline:
+      time.sleep(0.01)
+    self.assertEqual(cache.tagged('x'), ['b'])
+    self.assertEqual(pickle.loads(pickle.dumps(cache)).tagged('x'), ['b'])
+
+  def test_hot_keys(self):
+    with self.assertRaises(ValueError):
+      LruCache().hot_keys()
+    cache = LruCache(maxsize=2, hot_keys=4)
+    self.assertEqual(cache.items(), [])
+    cache['a'] = 1
+    for _ in range(3):
+      cache.get('a')
+      cache.get('b')
+    cache.get_many(['c', 'a'])
+    self.assertEqual([(key, count) for key, count, _ in cache.hot_keys(2)],
+                     [('a', 5), ('b', 3)])
+    self.assertEqual([(key, count) for key, count, _ in cache.missed_keys()],
+                     [('b', 3), ('c', 1)])
+    # the copy tracks hot keys, but counts start over
+    copy = pickle.loads(pickle.dumps(cache))
+    copy.get('a')
+    self.assertEqual([(key, count) for key, count, _ in copy.hot_keys(1)],
+                     [('a', 2)])
+
+  def test_hot_keys_get_or_set(self):
+    cache = LruCache(maxsize=2, hot_keys=4)
+    cache.get_or_set('a', lambda: 1)
+    # one lookup that missed, the add of the loaded value is not an access
+    self.assertEqual([(key, count) for key, count, _ in cache.hot_keys()],
+                     [('a', 1)])
+    self.assertEqual([(key, count) for key, count, _ in cache.missed_keys()],
+                     [('a', 1)])
+    cache.get_or_set('a', lambda: 2)
+    cache['a'] = 3
+    self.assertEqual([(key, count) for key, count, _ in cache.hot_keys()],
+                     [('a', 3)])
+    self.assertEqual([(key, count) for key, count, _ in cache.missed_keys()],
+                     [('a', 1)])
+
   def test_create_node(self):
     node = _create_node(expires=10)
     self.assertIsInstance(node, _ExpNode)
+    # the node doesn't know the clock, so it shows when it expires
+    self.assertEqual(repr(_create_node('a', 1, expires=10)),
+                     '_ExpNode a:(expires at 10)')
 
     node = _create_node()
     self.assertIsInstance(node, _Node)
@@ -206,6 +361,96 @@ class LruCacheTestCase(unittest.TestCase):
     lock.__exit__.assert_called()
 
 
+class LruCacheLifecycleTestCase(unittest.TestCase):
+  def _wait_until_gone(self, cache, key, timeout=2):
+    deadline = time.time() + timeout
+    while key in cache and time.time() < deadline:
+      time.sleep(0.01)
+
+  def test_expires(self):
+    cache = LruCache(maxsize=10)
+    cache.add('a', 1, expires=0.3)
+    del cache['a']
+    cache.add('b', 2, expires=0.05)
+    cache.add('c', 3, expires=10)
+    self._wait_until_gone(cache, 'b')
+    self.assertEqual(cache.items(), [('c', 3)])
+    self.assertTrue(cache._cleaner_manager._cache_cleaner.is_alive())
+
+  def test_close(self):
+    with LruCache(maxsize=10) as cache:
+      cache.add('a', 1, expires=10)
+      cleaner = cache._cleaner_manager._cache_cleaner
+    cleaner.join(2)
+    self.assertFalse(cleaner.is_alive())
+    self.assertEqual(cache.items(), [('a', 1)])
+    # a new expiring item starts a new cleaner
+    cache.add('b', 2, expires=0.05)
+    self._wait_until_gone(cache, 'b')
+    self.assertEqual(cache.items(), [('a', 1)])
+
+  def test_collected(self):
+    cache = LruCache(maxsize=10)
+    cache.add('a', 1, expires=10)
+    cleaner = cache._cleaner_manager._cache_cleaner
+    del cache
+    gc.collect()
+    cleaner.join(2)
+    self.assertFalse(cleaner.is_alive())
+
+  def test_pickle(self):
+    cache = LruCache(maxsize=10, expires=10)
+    cache.update([('a', 1), ('b', 2)])
+    cache.add('c', 3, expires=0.01)
+    time.sleep(0.02)
+    copy = pickle.loads(pickle.dumps(cache))
+    self.assertEqual(copy.items(), [('b', 2), ('a', 1)])
+    self.assertEqual(copy._maxsize, 10)
+    self.assertEqual(copy._expires, 10)
+    self.assertTrue(0 < copy._mapping['a'].expires - copy._clock.now() <= 10)
+
+  def test_clock(self):
+    clock = VirtualClock()
+    cache = LruCache(maxsize=10, expires=60, clock=clock)
+    cache.update([('a', 1), ('b', 2)])
+    cache.add('c', 3, expires=120)
+    clock.advance(59)
+    self.assertEqual(cache.get_many(['a', 'b', 'c']), [1, 2, 3])
+    clock.advance(1)
+    # expired items are never returned, even before the cleaner runs
+    self.assertEqual(cache.get('a'), None)
+    self.assertNotIn('b', cache)
+    self.assertEqual(cache.keys(), ['c'])
+    cache.add('d', 4, expires=10)
+    clock.advance(60)
+    deadline = time.time() + 2
+    while len(cache) and time.time() < deadline:
+      time.sleep(0.01)
+    self.assertEqual(len(cache), 0)
+
+  @unittest.skipUnless(hasattr(os, 'register_at_fork'), 'requires os.register_at_fork')
+  def test_fork(self):
+    cache = LruCache(maxsize=10, concurrent=True)
+    cache.add('a', 1, expires=10)
+    # pretend another thread holds the lock while forking
+    cache._lock.acquire()
+    try:
+      pid = os.fork()
+    finally:
+      if pid:
+        cache._lock.release()
+    if not pid:
+      code = 1
+      try:
+        cache.add('b', 2, expires=0.05)
+        self._wait_until_gone(cache, 'b')
+        code = 0 if cache.keys() == ['a'] else 1
+      finally:
+        os._exit(code)
+    _, status = os.waitpid(pid, 0)
+    self.assertEqual(os.WEXITSTATUS(status), 0)
+
+
 class CleanManagerTestCase(unittest.TestCase):
   @mock.patch('threading.Condition')
   @mock.patch('lru.compat.queue.PriorityQueue')
@@ -218,24 +463,24 @@ class CleanManagerTestCase(unittest.TestCase):
     self.clean_manager = _CleanManager(cache)
 
   def _assert_on_add(self, node):
-    self.queue_mock.put.assert_called_once_with(node)
+    self.queue_mock.put.assert_called_once_with((node.expires, mock.ANY, node))
     self.condition_mock.__enter__.assert_called_once()
     self.condition_mock.__exit__.assert_called_once()
     self.condition_mock.notify.assert_called()
 
-  @mock.patch('weakref.proxy')
-  def test_add(self, proxy_mock):
-    node = _ExpNode()
-    proxy_mock.return_value = node
+  @mock.patch('weakref.ref')
+  def test_add(self, ref_mock):
+    node = _ExpNode(expires=10)
+    ref_mock.return_value = node
 
     self.clean_manager.add(node)
     self.cleaner_mock.start.assert_called_once()
     self._assert_on_add(node)
 
-  @mock.patch('weakref.proxy')
-  def test_add_when_initialized(self, proxy_mock):
-    node = _ExpNode()
-    proxy_mock.return_value = node
+  @mock.patch('weakref.ref')
+  def test_add_when_initialized(self, ref_mock):
+    node = _ExpNode(expires=10)
+    ref_mock.return_value = node
 
     self.clean_manager._initialized = True
     self.clean_manager.add(node)
@@ -243,6 +488,16 @@ class CleanManagerTestCase(unittest.TestCase):
     self.cleaner_mock.start.assert_not_called()
     self._assert_on_add(node)
 
+  def test_stop(self):
+    self.clean_manager.stop()
+    self.queue_mock.put.assert_not_called()
+
+    self.clean_manager._initialized = True
+    self.clean_manager.stop()
+    self.queue_mock.put.assert_called_once_with(
+      (float('-inf'), mock.ANY, _sentinel))
+    self.condition_mock.notify.assert_called()
+
   def test_delete(self):
     self.clean_manager.on_delete()
     self.condition_mock.__enter__.assert_called_once()
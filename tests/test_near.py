@@ -0,0 +1,128 @@
+# -*- coding: future_fstrings -*-
+import os
+import sys
+import threading
+import unittest
+
+try:
+  import unittest.mock as mock
+except ImportError:
+  import mock
+
+from lru.near import DictBackend, NearCache, RemoteBackend
+
+
+class SlowBackend(DictBackend):
+  """Blocks get_many until released, to keep fetches in flight."""
+
+  def __init__(self):
+    super(SlowBackend, self).__init__()
+    self.started = threading.Event()
+    self.release = threading.Event()
+    self.calls = []
+
+  def get_many(self, keys):
+    self.calls.append(list(keys))
+    self.started.set()
+    self.release.wait(5)
+    return super(SlowBackend, self).get_many(keys)
+
+
+class DictBackendTestCase(unittest.TestCase):
+  def test_backend(self):
+    backend = DictBackend()
+    callback = mock.Mock()
+    backend.subscribe(callback)
+    backend.set('a', 1)
+    backend.set('b', 2, expires=-1)
+    self.assertEqual(backend.get_many(['a', 'b', 'c']), {'a': 1})
+    backend.delete('a')
+    self.assertEqual(backend.get_many(['a']), {})
+    self.assertEqual(callback.call_args_list,
+                     [mock.call('a'), mock.call('b'), mock.call('a')])
+
+  def test_interface(self):
+    backend = RemoteBackend()
+    with self.assertRaises(NotImplementedError):
+      backend.get_many(['a'])
+    backend.subscribe(mock.Mock())
+
+
+class NearCacheTestCase(unittest.TestCase):
+  def setUp(self):
+    self.backend = DictBackend()
+    self.backend.set('a', 1)
+    self.backend.set('b', 2)
+
+  def test_get(self):
+    cache = NearCache(self.backend)
+    with mock.patch.object(self.backend, 'get_many',
+                           wraps=self.backend.get_many) as get_many:
+      self.assertEqual(cache.get('a'), 1)
+      self.assertEqual(cache.get('a'), 1)
+      self.assertEqual(cache.get('c', 3), 3)
+      self.assertTrue('b' in cache)
+      self.assertEqual(get_many.call_args_list,
+                       [mock.call(['a']), mock.call(['c']), mock.call(['b'])])
+    self.assertEqual(len(cache), 2)
+
+  def test_get_many(self):
+    cache = NearCache(self.backend)
+    cache.get('a')
+    with mock.patch.object(self.backend, 'get_many',
+                           wraps=self.backend.get_many) as get_many:
+      self.assertEqual(cache.get_many(['a', 'b', 'c', 'b']), {'a': 1, 'b': 2})
+      get_many.assert_called_once_with(['b', 'c'])
+
+  def test_invalidation(self):
+    first, second = NearCache(self.backend), NearCache(self.backend)
+    self.assertEqual(first.get('a'), 1)
+    second.set('a', 10)
+    self.assertEqual(first.get('a'), 10)
+    second.delete('a')
+    self.assertIsNone(first.get('a'))
+    self.assertEqual(len(first), 0)
+
+  def test_coalescing(self):
+    backend = SlowBackend()
+    backend.set('a', 1)
+    cache = NearCache(backend)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get('a')))
+               for _ in range(4)]
+    for thread in threads:
+      thread.start()
+    backend.started.wait(5)
+    backend.release.set()
+    for thread in threads:
+      thread.join(5)
+    self.assertEqual(results, [1] * 4)
+    self.assertEqual(len(backend.calls), 1)
+
+  def test_invalidated_in_flight(self):
+    backend = SlowBackend()
+    backend.set('a', 1)
+    cache = NearCache(backend)
+    thread = threading.Thread(target=cache.get, args=('a',))
+    thread.start()
+    backend.started.wait(5)
+    cache.invalidate('a')
+    backend.release.set()
+    thread.join(5)
+    # the value might be stale, so it must not be cached
+    self.assertEqual(len(cache), 0)
+
+  def test_error(self):
+    backend = SlowBackend()
+    cache = NearCache(backend)
+    backend.get_many = mock.Mock(side_effect=IOError)
+    with self.assertRaises(IOError):
+      cache.get('a')
+    self.assertEqual(cache._flights, {})
+
+
+def main():
+  unittest.main()
+
+if __name__ == '__main__':
+  main()
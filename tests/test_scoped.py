@@ -0,0 +1,113 @@
+# -*- coding: future_fstrings -*-
+import sys
+import threading
+import unittest
+
+try:
+  import unittest.mock as mock
+except ImportError:
+  import mock
+
+from lru import LruCache
+from lru.compat import contextvars
+from lru.scoped import ScopedCache
+
+
+class ScopedCacheTestCase(unittest.TestCase):
+  def setUp(self):
+    self.shared = LruCache(maxsize=10, concurrent=True)
+    for method in ('get', 'get_many'):
+      patcher = mock.patch.object(
+        self.shared, method, wraps=getattr(self.shared, method))
+      patcher.start()
+      self.addCleanup(patcher.stop)
+    self.cache = ScopedCache(self.shared)
+    self.shared.add('a', 1)
+
+  def test_outside_of_scope(self):
+    self.assertFalse(self.cache.in_scope)
+    self.assertEqual(self.cache.get('a'), 1)
+    self.assertEqual(self.cache.get('a'), 1)
+    self.assertEqual(self.shared.get.call_count, 2)
+
+  def test_scope(self):
+    with self.cache.scope():
+      self.assertTrue(self.cache.in_scope)
+      for _ in range(5):
+        self.assertEqual(self.cache['a'], 1)
+        self.assertNotIn('b', self.cache)
+      self.assertEqual(self.shared.get.call_count, 2)
+      # a scope sees the value it has read first
+      self.shared.add('a', 2)
+      self.assertEqual(self.cache['a'], 1)
+      with self.cache.scope():
+        self.assertEqual(self.cache['a'], 1)
+      self.assertTrue(self.cache.in_scope)
+    self.assertFalse(self.cache.in_scope)
+    self.assertEqual(self.cache['a'], 2)
+
+  def test_writes(self):
+    with self.cache.scope():
+      self.cache['b'] = 2
+      self.assertEqual(self.cache['b'], 2)
+      del self.cache['a']
+      self.assertNotIn('a', self.cache)
+      self.assertEqual(self.cache.get_or_set('c', lambda: 3), 3)
+      self.assertEqual(self.cache.get_or_set('c', lambda: 4), 3)
+      self.shared.get.reset_mock()
+      self.assertEqual(self.cache.get_many(['a', 'b', 'c']), [None, 2, 3])
+      self.shared.get.assert_not_called()
+      self.shared.get_many.assert_not_called()
+    self.assertEqual(self.shared.items(), [('c', 3), ('b', 2)])
+
+  def test_get_many(self):
+    self.shared.add('b', 2)
+    with self.cache.scope():
+      self.assertEqual(self.cache.get_many(['a', 'x']), [1, None])
+      self.assertEqual(self.cache.get_many(['a', 'b', 'x'], 0), [1, 2, 0])
+      self.assertEqual(
+        [call[0][0] for call in self.shared.get_many.call_args_list],
+        [['a', 'x'], ['b']])
+
+  def test_decorator(self):
+    @self.cache
+    def handle():
+      self.assertTrue(self.cache.in_scope)
+      return self.cache['a'] + self.cache['a']
+
+    self.assertEqual(handle(), 2)
+    self.assertEqual(handle.__name__, 'handle')
+    self.assertEqual(self.shared.get.call_count, 1)
+    self.assertFalse(self.cache.in_scope)
+
+  @unittest.skipUnless(hasattr(threading, 'Barrier'), 'requires threading.Barrier')
+  def test_threads(self):
+    seen = []
+    def handle(value):
+      with self.cache.scope():
+        self.cache['a'] = value
+        barrier.wait()
+        seen.append((value, self.cache['a']))
+    barrier = threading.Barrier(3)
+    threads = [threading.Thread(target=handle, args=(value,))
+               for value in range(3)]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    self.assertEqual(sorted(seen), [(0, 0), (1, 1), (2, 2)])
+
+  # without contextvars, tasks of the same thread share a scope
+  @unittest.skipUnless(sys.version_info >= (3, 5) and contextvars is not None,
+                       'requires coroutines and contextvars')
+  def test_tasks(self):
+    from _scoped_tasks import run_tasks
+    self.assertEqual(run_tasks(self.cache, range(3)), [0, 1, 2])
+    self.assertFalse(self.cache.in_scope)
+
+
+def main():
+  unittest.main()
+
+if __name__ == '__main__':
+  main()
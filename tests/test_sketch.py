@@ -0,0 +1,71 @@
+# -*- coding: future_fstrings -*-
+import os
+import random
+import sys
+import unittest
+
+from collections import Counter
+
+from lru.sketch import HeavyHitter, HotKeys, SpaceSaving
+
+
+class SpaceSavingTestCase(unittest.TestCase):
+  def _check_buckets(self, summary):
+    bucket, previous, total = summary._head, None, 0
+    while bucket is not None:
+      self.assertTrue(bucket.counters)
+      self.assertIs(bucket.prev, previous)
+      if previous is not None:
+        self.assertLess(previous.count, bucket.count)
+      for counter in bucket.counters.values():
+        self.assertIs(counter.bucket, bucket)
+      total += len(bucket.counters)
+      previous, bucket = bucket, bucket.next
+    self.assertEqual(total, len(summary))
+
+  def test_capacity(self):
+    with self.assertRaises(ValueError):
+      SpaceSaving(0)
+
+  def test_exact(self):
+    summary = SpaceSaving(capacity=3)
+    for key in 'abacabad':
+      summary.offer(key)
+    self.assertEqual(summary.top(), [HeavyHitter('a', 4, 0), HeavyHitter('b', 2, 0),
+                                     HeavyHitter('d', 2, 1)])
+    self.assertEqual(summary.top(1), [HeavyHitter('a', 4, 0)])
+    self._check_buckets(summary)
+    summary.clear()
+    self.assertEqual(summary.top(), [])
+
+  def test_heavy_hitters(self):
+    generator = random.Random(0)
+    stream = [int(generator.paretovariate(1.2)) for _ in range(50000)]
+    exact = Counter(stream)
+    summary = SpaceSaving(capacity=50)
+    for key in stream:
+      summary.offer(key)
+    self._check_buckets(summary)
+    self.assertEqual(len(summary), 50)
+    top = summary.top(5)
+    self.assertEqual([hitter.key for hitter in top],
+                     [key for key, _ in exact.most_common(5)])
+    for key, count, error in summary.top():
+      self.assertTrue(count - error <= exact[key] <= count)
+
+
+class HotKeysTestCase(unittest.TestCase):
+  def test_observer(self):
+    hot = HotKeys(capacity=4)
+    hot.on_add('a')
+    hot.on_access('a', True)
+    hot.on_access('b', False)
+    self.assertEqual(hot.accessed.top(1), [HeavyHitter('a', 2, 0)])
+    self.assertEqual(hot.missed.top(), [HeavyHitter('b', 1, 0)])
+
+
+def main():
+  unittest.main()
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,137 @@
+# -*- coding: future_fstrings -*-
+import pickle
+import unittest
+
+from lru.clock import VirtualClock
+from lru.slab import SlabCache, _SlabAllocator
+
+
+class SlabAllocatorTestCase(unittest.TestCase):
+  def test_size_classes(self):
+    allocator = _SlabAllocator(1024, 256, 16, 2)
+    self.assertEqual(allocator._sizes, [16, 32, 64, 128, 256])
+    self.assertEqual(allocator.size_class(0), 0)
+    self.assertEqual(allocator.size_class(16), 0)
+    self.assertEqual(allocator.size_class(17), 1)
+    self.assertEqual(allocator.size_class(256), 4)
+    with self.assertRaises(ValueError):
+      allocator.size_class(257)
+    with self.assertRaises(ValueError):
+      _SlabAllocator(1024, 256, 16, 1)
+
+  def test_allocate(self):
+    allocator = _SlabAllocator(512, 256, 64, 2)
+    chunks = [allocator.allocate(0) for _ in range(4)]
+    self.assertEqual(len(set(id(slab) for slab, _ in chunks)), 1)
+    self.assertEqual(sorted(offset for _, offset in chunks), [0, 64, 128, 192])
+    big = allocator.allocate(2)
+    self.assertIsNotNone(big)
+    # both slabs are taken
+    self.assertIsNone(allocator.allocate(0))
+    self.assertIsNone(allocator.allocate(1))
+    allocator.free(*chunks[0])
+    self.assertEqual(allocator.allocate(0), chunks[0])
+    # a slab that has become empty can serve another class
+    allocator.free(*big)
+    slab, offset = allocator.allocate(1)
+    self.assertIs(slab, big[0])
+    self.assertEqual(slab.size_class, 1)
+
+
+class SlabCacheTestCase(unittest.TestCase):
+  def _cache(self, **kwargs):
+    kwargs.setdefault('maxbytes', 1024)
+    kwargs.setdefault('slab_size', 256)
+    kwargs.setdefault('min_chunk', 16)
+    kwargs.setdefault('growth_factor', 2)
+    return SlabCache(**kwargs)
+
+  def test_values(self):
+    cache = self._cache()
+    cache['a'] = b'foo'
+    cache['b'] = bytearray(b'bar' * 10)
+    view = cache['a']
+    self.assertIsInstance(view, memoryview)
+    self.assertEqual(bytes(view), b'foo')
+    self.assertEqual(bytes(cache.get('b')), b'bar' * 10)
+    self.assertEqual([bytes(value) for value in cache.get_many(['a', 'c', 'b'], b'')],
+                     [b'foo', b'', b'bar' * 10])
+    self.assertEqual(sorted((key, bytes(value)) for key, value in cache.items()),
+                     [('a', b'foo'), ('b', b'bar' * 10)])
+    cache['a'] = b'spam'
+    self.assertEqual(bytes(cache['a']), b'spam')
+    with self.assertRaises(TypeError):
+      cache['c'] = 42
+    with self.assertRaises(ValueError):
+      cache['c'] = b'x' * 257
+    self.assertNotIn('c', cache)
+
+  def test_zero_copy(self):
+    cache = self._cache()
+    cache['a'] = b'foo'
+    first, second = cache['a'], cache['a']
+    self.assertIs(first.obj, second.obj)
+
+  def test_reuse(self):
+    cache = self._cache(maxbytes=256)
+    for key in range(16):
+      cache[key] = bytes(bytearray([key])) * 16
+    self.assertEqual(len(cache), 16)
+    # the slab is full, the least recently used value makes room
+    cache[0]
+    cache[16] = b'x' * 16
+    self.assertNotIn(1, cache)
+    self.assertIn(0, cache)
+    self.assertEqual(bytes(cache[16]), b'x' * 16)
+    self.assertEqual(cache._allocator._slabs, 1)
+
+  def test_size_class_eviction(self):
+    cache = self._cache(maxbytes=512)
+    cache['small'] = b's'
+    cache['big'] = b'b' * 200
+    # both slabs are taken, values of another class have to wait
+    # until one of them is completely free
+    cache['medium'] = b'm' * 50
+    self.assertEqual(cache.keys(), ['medium', 'big'])
+    cache['big2'] = b'B' * 200
+    self.assertEqual(cache.keys(), ['big2', 'medium'])
+
+  def test_class_recency(self):
+    cache = self._cache(maxbytes=512)
+    cache['big'] = b'b' * 200
+    for key in range(8):
+      cache[key] = b'x' * 20
+    # the oldest values of the class, not of the cache, are evicted
+    cache[0]
+    cache[8] = b'y' * 20
+    self.assertEqual(sorted(key for key in cache.keys() if key != 'big'),
+                     [0] + list(range(2, 9)))
+    self.assertIn('big', cache)
+    self.assertEqual(list(cache._classes[1]), [2, 3, 4, 5, 6, 7, 0, 8])
+    del cache[3]
+    self.assertEqual(list(cache._classes[1]), [2, 4, 5, 6, 7, 0, 8])
+
+  def test_expired_chunks(self):
+    clock = VirtualClock()
+    cache = self._cache(maxbytes=256, expires=10, clock=clock)
+    cache.update((key, b'x' * 16) for key in range(16))
+    clock.advance(10)
+    for key in range(16):
+      self.assertNotIn(key, cache)
+    slab = next(iter(cache._allocator._empty))
+    self.assertEqual(len(slab.free), 16)
+
+  def test_pickle(self):
+    cache = self._cache(maxsize=10)
+    cache.update([('a', b'foo'), ('b', b'bar')])
+    copy = pickle.loads(pickle.dumps(cache))
+    self.assertEqual([(key, bytes(value)) for key, value in copy.items()],
+                     [('b', b'bar'), ('a', b'foo')])
+    self.assertEqual(copy._options, cache._options)
+
+
+def main():
+  unittest.main()
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,109 @@
+# -*- coding: future_fstrings -*-
+import threading
+import time
+import unittest
+
+from lru.snapshot import SnapshotCache
+
+
+class SnapshotCacheTestCase(unittest.TestCase):
+  def test_publish(self):
+    cache = SnapshotCache(maxsize=10)
+    cache.set('a', 1)
+    self.assertIsNone(cache.get('a'))
+    self.assertNotIn('a', cache)
+    self.assertEqual(cache.publish(), 1)
+    self.assertEqual(cache['a'], 1)
+    cache.delete('a')
+    cache.set('b', 2)
+    self.assertEqual(cache['a'], 1)
+    cache.publish()
+    with self.assertRaises(KeyError):
+      cache['a']
+    self.assertEqual(cache.keys(), ['b'])
+    with self.assertRaises(ValueError):
+      cache.set('c', None)
+    with self.assertRaises(ValueError):
+      SnapshotCache(maxsize=0)
+
+  def test_items(self):
+    cache = SnapshotCache([('a', 1), ('b', 2)])
+    self.assertEqual(len(cache), 2)
+    self.assertEqual(cache.get('b'), 2)
+    self.assertEqual(cache.get_many(['a', 'c', 'b'], 0), [1, 0, 2])
+    cache.clear()
+    self.assertEqual(len(cache), 0)
+    cache.set('c', 3)
+    cache.publish()
+    self.assertEqual(cache['c'], 3)
+
+  def test_snapshot_is_immutable(self):
+    cache = SnapshotCache([('a', 1)])
+    snapshot = cache._snapshot
+    cache.set('a', 2)
+    cache.set('b', 3)
+    cache.publish()
+    self.assertEqual(snapshot['a'][0], 1)
+    self.assertNotIn('b', snapshot)
+    self.assertEqual(cache['a'], 2)
+
+  def test_expires(self):
+    cache = SnapshotCache(expires=0.05)
+    cache.set('a', 1)
+    cache.set('b', 2, expires=60)
+    cache.publish()
+    self.assertEqual(cache['a'], 1)
+    time.sleep(0.1)
+    self.assertNotIn('a', cache)
+    self.assertEqual(len(cache), 2)
+    cache.publish()
+    self.assertEqual(cache.keys(), ['b'])
+
+  def test_eviction(self):
+    cache = SnapshotCache(((key, key) for key in 'abc'), maxsize=3)
+    cache['a']
+    cache['c']
+    cache.set('d', 'd')
+    cache.publish()
+    self.assertEqual(sorted(cache.keys()), ['a', 'c', 'd'])
+    # the hand has cleared the bits it has passed
+    cache.set('e', 'e')
+    cache.publish()
+    self.assertEqual(sorted(cache.keys()), ['c', 'd', 'e'])
+    cache.set('c', 'C')
+    cache.delete('d')
+    cache.publish()
+    self.assertEqual(sorted(cache.keys()), ['c', 'e'])
+    self.assertEqual(cache['c'], 'C')
+    for key in 'fgh':
+      cache.set(key, key)
+    cache.publish()
+    self.assertEqual(len(cache), 3)
+
+  def test_concurrent_readers(self):
+    cache = SnapshotCache(((key, 0) for key in range(10)), maxsize=10)
+    stop, seen = threading.Event(), []
+
+    def read():
+      while not stop.is_set():
+        # all the keys of a batch are published at once
+        seen.append(len(set(cache.get_many(range(10)))))
+
+    readers = [threading.Thread(target=read) for _ in range(4)]
+    for reader in readers:
+      reader.start()
+    for version in range(1, 100):
+      for key in range(10):
+        cache.set(key, version)
+      cache.publish()
+    stop.set()
+    for reader in readers:
+      reader.join()
+    self.assertEqual(set(seen), {1})
+
+
+def main():
+  unittest.main()
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,155 @@
+# -*- coding: future_fstrings -*-
+import os
+import threading
+import unittest
+
+from lru.writeback import WriteBackCache, WRITE_THROUGH, _flush_all
+
+
+class Store(object):
+  def __init__(self):
+    self.data = {}
+    self.batches = []
+    self.fail = False
+    self.written = threading.Event()
+
+  def write_many(self, items):
+    if self.fail:
+      raise IOError('the store is down')
+    self.batches.append(dict(items))
+    self.data.update(items)
+    self.written.set()
+
+
+class WriteBackCacheTestCase(unittest.TestCase):
+  def setUp(self):
+    self.store = Store()
+
+  def _cache(self, **kwargs):
+    kwargs.setdefault('flush_interval', 60)
+    cache = WriteBackCache(self.store, **kwargs)
+    self.addCleanup(cache.close)
+    return cache
+
+  def test_policy(self):
+    with self.assertRaises(ValueError):
+      WriteBackCache(self.store, policy='sideways')
+
+  def test_write_through(self):
+    cache = self._cache(policy=WRITE_THROUGH)
+    cache['a'] = 1
+    cache.add('b', 2)
+    self.assertEqual(self.store.batches, [{'a': 1}, {'b': 2}])
+    self.assertEqual(cache.dirty, 0)
+    with self.assertRaises(ValueError):
+      cache['c'] = None
+    self.store.fail = True
+    with self.assertRaises(IOError):
+      cache['c'] = 3
+    self.assertNotIn('c', cache)
+
+  def test_coalescing(self):
+    cache = self._cache()
+    for value in range(10):
+      cache['a'] = value
+    cache['b'] = 1
+    self.assertEqual(self.store.batches, [])
+    self.assertEqual(cache.dirty, 2)
+    cache.flush()
+    self.assertEqual(self.store.batches, [{'a': 9, 'b': 1}])
+    self.assertEqual(cache.dirty, 0)
+    cache.flush()
+    self.assertEqual(len(self.store.batches), 1)
+
+  def test_flush_size(self):
+    cache = self._cache(flush_size=3)
+    cache.update([('a', 1), ('b', 2)])
+    self.assertFalse(self.store.written.wait(0.1))
+    cache['c'] = 3
+    self.assertTrue(self.store.written.wait(2))
+    self.assertEqual(self.store.data, {'a': 1, 'b': 2, 'c': 3})
+
+  def test_flush_interval(self):
+    cache = self._cache(flush_interval=0.05)
+    cache['a'] = 1
+    self.assertTrue(self.store.written.wait(2))
+    self.assertEqual(self.store.data, {'a': 1})
+
+  def test_eviction(self):
+    cache = self._cache(maxsize=2)
+    cache.update([('a', 1), ('b', 2)])
+    cache['c'] = 3
+    # 'a' has been written before being evicted
+    self.assertEqual(self.store.batches, [{'a': 1}])
+    self.assertEqual(cache.dirty, 2)
+
+  def test_expiration(self):
+    cache = self._cache()
+    cache.add('a', 1, expires=0.05)
+    self.assertTrue(self.store.written.wait(2))
+    self.assertEqual(self.store.batches, [{'a': 1}])
+    self.assertNotIn('a', cache)
+
+  def test_delete(self):
+    cache = self._cache()
+    cache['a'] = 1
+    del cache['a']
+    cache.flush()
+    self.assertEqual(self.store.data, {'a': 1})
+
+  def test_failure(self):
+    cache = self._cache(maxsize=1)
+    cache['a'] = 1
+    self.store.fail = True
+    with self.assertRaises(IOError):
+      cache.flush()
+    # failing to write an evicted item keeps it dirty
+    cache['b'] = 2
+    self.assertEqual(cache.dirty, 2)
+    self.store.fail = False
+    cache.flush()
+    self.assertEqual(self.store.data, {'a': 1, 'b': 2})
+
+  def test_close(self):
+    cache = WriteBackCache(self.store, flush_interval=60)
+    cache['a'] = 1
+    flusher = cache._flusher
+    cache.close()
+    self.assertFalse(flusher.is_alive())
+    self.assertEqual(self.store.data, {'a': 1})
+
+  def test_exit(self):
+    cache = self._cache()
+    cache['a'] = 1
+    _flush_all()
+    self.assertEqual(self.store.data, {'a': 1})
+
+  @unittest.skipUnless(hasattr(os, 'register_at_fork'), 'requires os.register_at_fork')
+  def test_fork(self):
+    cache = self._cache()
+    cache['a'] = 1
+    pid = os.fork()
+    if not pid:
+      code = 1
+      try:
+        # the parent writes 'a', the child must not write it again
+        cache['b'] = 2
+        cache.flush()
+        code = 0 if self.store.batches == [{'b': 2}] else 1
+      finally:
+        os._exit(code)
+    _, status = os.waitpid(pid, 0)
+    self.assertEqual(os.WEXITSTATUS(status), 0)
+    self.assertEqual(cache.dirty, 1)
+
+  def test_pickle(self):
+    import pickle
+    with self.assertRaises(TypeError):
+      pickle.dumps(self._cache())
+
+
+def main():
+  unittest.main()
+
+if __name__ == '__main__':
+  main()